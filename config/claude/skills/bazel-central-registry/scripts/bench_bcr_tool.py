@@ -0,0 +1,542 @@
+#!/usr/bin/env python3
+"""Benchmarks for bcr_tool.py and registry.py.
+
+Run from anywhere; the script imports its siblings from its own directory.
+"""
+
+from __future__ import annotations
+
+import argparse
+import functools
+import http.server
+import json
+import os
+import pathlib
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+BCR_TOOL = pathlib.Path(__file__).resolve().parent / "bcr_tool.py"
+
+import bazel_version  # noqa: E402
+import bcr_tool  # noqa: E402
+
+
+def _best_of(repeat: int, func: Callable[[], object]) -> Tuple[float, object]:
+    best = float("inf")
+    result: object = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def _generate_module_file(lines: int, seed: int = 0) -> str:
+    """Generate a MODULE.bazel of roughly `lines` lines with a realistic call mix."""
+    rng = random.Random(seed)
+    out = ['module(name = "bench", version = "0.0.0", compatibility_level = 1)', ""]
+    i = 0
+    while len(out) < lines:
+        name = f"dep_{i}"
+        version = f"{rng.randrange(10)}.{rng.randrange(20)}.{rng.randrange(5)}"
+        kind = rng.random()
+        if kind < 0.55:
+            out.append(f'bazel_dep(name = "{name}", version = "{version}")')
+        elif kind < 0.75:
+            out.extend(
+                [
+                    "bazel_dep(",
+                    f'    name = "{name}",',
+                    f'    version = "{version}",',
+                    f'    repo_name = "{name}_repo",  # keep the (legacy) repo name',
+                    "    dev_dependency = True,",
+                    ")",
+                ]
+            )
+        elif kind < 0.85:
+            out.append(f'single_version_override(module_name = "{name}", version = "{version}")')
+        elif kind < 0.9:
+            out.extend(
+                [
+                    "archive_override(",
+                    f'    module_name = "{name}",',
+                    f'    urls = ["https://example.com/{name}-{version}.tar.gz"],',
+                    f'    strip_prefix = "{name}-{version}",',
+                    ")",
+                ]
+            )
+        else:
+            out.append(f"# {name} is pinned by the platform team; see docs/{name}.md")
+        i += 1
+    return "\n".join(out[:lines]) + "\n"
+
+
+def _legacy_extract_calls(text: str, call_name: str) -> Iterable[Tuple[int, int, str]]:
+    # The per-call-kind scanner bcr_tool used before the single-pass tokenizer.
+    pattern = re.compile(rf"\b{re.escape(call_name)}\s*\(")
+    idx = 0
+    while True:
+        match = pattern.search(text, idx)
+        if not match:
+            break
+        start = match.start()
+        i = match.end() - 1
+        depth = 0
+        in_str: Optional[str] = None
+        escape = False
+        while i < len(text):
+            ch = text[i]
+            if in_str:
+                if escape:
+                    escape = False
+                elif ch == "\\":
+                    escape = True
+                elif ch == in_str:
+                    in_str = None
+            else:
+                if ch in ("\"", "'"):
+                    in_str = ch
+                elif ch == "(":
+                    depth += 1
+                elif ch == ")":
+                    depth -= 1
+                    if depth == 0:
+                        end = i + 1
+                        yield start, end, text[start:end]
+                        idx = end
+                        break
+            i += 1
+        else:
+            break
+
+
+def _legacy_find_kwarg_string(block: str, key: str) -> Optional[str]:
+    match = re.search(rf"\b{re.escape(key)}\s*=\s*([\"'])([^\"']+)\1", block)
+    if not match:
+        return None
+    return match.group(2)
+
+
+def _legacy_scan(text: str) -> int:
+    count = 0
+    for call_name, key in (("bazel_dep", "name"), ("single_version_override", "module_name"), ("archive_override", "module_name")):
+        for start, _, block in _legacy_extract_calls(text, call_name):
+            if _legacy_find_kwarg_string(block, key):
+                _legacy_find_kwarg_string(block, "version")
+                text.count("\n", 0, start)
+                count += 1
+    return count
+
+
+def _tokenizer_scan(text: str) -> int:
+    calls = bcr_tool._tokenize_calls(text)
+    path = pathlib.Path("MODULE.bazel")
+    return sum(
+        len(bcr_tool._calls_to_deps(calls, path, call_name, key))
+        for call_name, key in (("bazel_dep", "name"), ("single_version_override", "module_name"), ("archive_override", "module_name"))
+    )
+
+
+@functools.total_ordering
+class _LegacyIdentifier:
+    # registry.Version.Identifier as compared before version keys.
+    def __init__(self, s: str) -> None:
+        self.val = int(s) if s.isnumeric() else s
+
+    def __eq__(self, other: object) -> bool:
+        assert isinstance(other, _LegacyIdentifier)
+        if type(self.val) != type(other.val):
+            return False
+        return self.val == other.val
+
+    def __lt__(self, other: "_LegacyIdentifier") -> bool:
+        if type(self.val) != type(other.val):
+            return type(self.val) == int
+        return self.val < other.val
+
+
+@functools.total_ordering
+class _LegacyVersion:
+    # registry.Version before version keys: recompiles its pattern per instance.
+    def __init__(self, version_str: str) -> None:
+        pattern = re.compile(r"^([a-zA-Z0-9.]+)(?:-([a-zA-Z0-9.-]+))?(?:\+[a-zA-Z0-9.-]+)?$")
+        m = pattern.match(version_str)
+        assert m
+        release, prerelease = m.groups()
+        self.release = [_LegacyIdentifier(i) for i in release.split(".")]
+        self.prerelease = None if prerelease is None else [_LegacyIdentifier(i) for i in prerelease.split(".")]
+
+    def __eq__(self, other: object) -> bool:
+        assert isinstance(other, _LegacyVersion)
+        return (self.release, self.prerelease) == (other.release, other.prerelease)
+
+    def __lt__(self, other: "_LegacyVersion") -> bool:
+        if self.release != other.release:
+            return self.release < other.release
+        if self.prerelease is None:
+            return False
+        if other.prerelease is None:
+            return True
+        return self.prerelease < other.prerelease
+
+
+def _generate_versions(count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    suffixes = ["", "", "", "", "-rc1", "-rc2", "-beta.1", "-alpha", "-pre.20240101", "+build.5", "-rc.1+meta"]
+    versions = []
+    for _ in range(count):
+        release = ".".join(str(rng.randrange(30)) for _ in range(rng.choice((1, 2, 3, 3, 3, 4))))
+        if rng.random() < 0.05:
+            release += f".{rng.choice(['bcr', 'x', 'patch1'])}"
+        versions.append(release + rng.choice(suffixes))
+    return versions
+
+
+def cmd_versions(args: argparse.Namespace) -> None:
+    import registry  # Needs PyYAML; imported here so `scan` works without it.
+
+    versions = _generate_versions(args.count)
+
+    def fast() -> List[str]:
+        bazel_version.version_key.cache_clear()
+        return registry.sort_versions(versions)
+
+    fast_seconds, fast_sorted = _best_of(args.repeat, fast)
+    warm_seconds, _ = _best_of(args.repeat, lambda: registry.sort_versions(versions))
+    class_seconds, class_sorted = _best_of(args.repeat, lambda: sorted(versions, key=registry.Version))
+    legacy_seconds, legacy_sorted = _best_of(args.repeat, lambda: sorted(versions, key=_LegacyVersion))
+    if fast_sorted != legacy_sorted or class_sorted != legacy_sorted:
+        raise SystemExit("version orderings differ")
+    report = {
+        "versions": args.count,
+        "legacy_class_seconds": round(legacy_seconds, 4),
+        "version_class_seconds": round(class_seconds, 4),
+        "sort_versions_cold_seconds": round(fast_seconds, 4),
+        "sort_versions_warm_seconds": round(warm_seconds, 4),
+        "speedup_cold": round(legacy_seconds / fast_seconds, 1),
+        "speedup_warm": round(legacy_seconds / warm_seconds, 1),
+    }
+    print(json.dumps(report, indent=2))
+
+
+def cmd_scan(args: argparse.Namespace) -> None:
+    text = _generate_module_file(args.lines)
+    tokenizer_seconds, tokenizer_calls = _best_of(args.repeat, lambda: _tokenizer_scan(text))
+    report = {
+        "lines": args.lines,
+        "bytes": len(text),
+        "calls": tokenizer_calls,
+        "tokenizer_seconds": round(tokenizer_seconds, 4),
+    }
+    if not args.skip_legacy:
+        legacy_seconds, legacy_calls = _best_of(args.repeat, lambda: _legacy_scan(text))
+        report["legacy_calls"] = legacy_calls
+        report["legacy_seconds"] = round(legacy_seconds, 4)
+        report["speedup"] = round(legacy_seconds / tokenizer_seconds, 1)
+    print(json.dumps(report, indent=2))
+
+
+SCALES = {
+    "small": {"modules": 50, "versions": 5, "fanout": 3, "module_lines": 40},
+    "medium": {"modules": 300, "versions": 10, "fanout": 5, "module_lines": 200},
+    "large": {"modules": 1500, "versions": 20, "fanout": 8, "module_lines": 1000},
+}
+COMMANDS = ("list-deps", "check-upgrades", "deps-tree", "upgrade")
+
+
+def _generate_registry(
+    root: pathlib.Path, modules: int, versions: int, fanout: int, module_lines: int, seed: int = 0
+) -> pathlib.Path:
+    """Write a synthetic registry under `root/modules` and a workspace that depends on it.
+
+    Module `i` only depends on higher-numbered modules, so the graph is a DAG
+    whose depth grows with the module count. Returns the workspace MODULE.bazel.
+    """
+    rng = random.Random(seed)
+    names = [f"bench_mod_{i}" for i in range(modules)]
+    version_list = [f"{major}.{minor}.0" for major in range(1, 4) for minor in range(versions)][:versions]
+    for i, name in enumerate(names):
+        module_dir = root / "modules" / name
+        module_dir.mkdir(parents=True, exist_ok=True)
+        metadata = {
+            "homepage": f"https://example.com/{name}",
+            "maintainers": [],
+            "versions": version_list,
+            "yanked_versions": {},
+        }
+        (module_dir / "metadata.json").write_text(json.dumps(metadata, indent=4), encoding="utf-8")
+        for version in version_list:
+            lines = [f'module(name = "{name}", version = "{version}", compatibility_level = 1)', ""]
+            for dep in rng.sample(names[i + 1 :], min(fanout, modules - i - 1)):
+                lines.append(f'bazel_dep(name = "{dep}", version = "{rng.choice(version_list)}")')
+            while len(lines) < module_lines:
+                lines.append(f"# padding line {len(lines)} to reach the requested MODULE.bazel size")
+            (module_dir / version).mkdir(exist_ok=True)
+            (module_dir / version / "MODULE.bazel").write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    workspace = root / "workspace"
+    workspace.mkdir(parents=True, exist_ok=True)
+    direct = names[: max(1, min(modules, fanout * 4))]
+    half = len(direct) // 2
+    root_lines = ['module(name = "bench_workspace", version = "0.0.0")', 'include("//:deps.MODULE.bazel")']
+    root_lines += [f'bazel_dep(name = "{name}", version = "{version_list[0]}")' for name in direct[:half]]
+    include_lines = [f'bazel_dep(name = "{name}", version = "{version_list[0]}")' for name in direct[half:]]
+    (workspace / "MODULE.bazel").write_text("\n".join(root_lines) + "\n", encoding="utf-8")
+    (workspace / "deps.MODULE.bazel").write_text("\n".join(include_lines) + "\n", encoding="utf-8")
+    return workspace / "MODULE.bazel"
+
+
+class _LatencyServer:
+    """Serves a directory over keep-alive HTTP on localhost, delaying every request.
+
+    Each request sleeps `latency` seconds plus uniform jitter in
+    [-jitter, +jitter]. `requests` counts requests since the last `reset()`.
+    """
+
+    def __init__(self, directory: pathlib.Path, latency: float, jitter: float, seed: int = 0) -> None:
+        rng = random.Random(seed)
+        lock = threading.Lock()
+        self.requests = 0
+        server = self
+
+        class Handler(http.server.SimpleHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def __init__(self, *args: object, **kwargs: object) -> None:
+                super().__init__(*args, directory=str(directory), **kwargs)  # type: ignore[arg-type]
+
+            def send_head(self):  # type: ignore[no-untyped-def]
+                with lock:
+                    server.requests += 1
+                    delay = max(0.0, latency + rng.uniform(-jitter, jitter))
+                time.sleep(delay)
+                return super().send_head()
+
+            def log_message(self, *args: object) -> None:
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def reset(self) -> None:
+        self.requests = 0
+
+    def close(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _command_argv(command: str, module_file: pathlib.Path, registry_url: str) -> List[str]:
+    argv = [command, "--module-file", str(module_file)]
+    if command != "list-deps":
+        argv += ["--registry-url", registry_url]
+    if command == "deps-tree":
+        argv += ["--max-depth", "3"]
+    return argv
+
+
+def _time_command(argv: Sequence[str], cache_home: pathlib.Path, server: _LatencyServer) -> Dict[str, object]:
+    server.reset()
+    # Always time the command itself, never a resident `serve` daemon it could hand off to.
+    env = dict(os.environ, XDG_CACHE_HOME=str(cache_home), BCR_TOOL_NO_DAEMON="1")
+    env.pop("BCR_TOOL_SOCKET", None)
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, str(BCR_TOOL), *argv], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    seconds = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise SystemExit(f"bcr_tool {' '.join(argv)} failed: {proc.stderr.strip()}")
+    return {"seconds": round(seconds, 4), "requests": server.requests}
+
+
+def _bench_scale(name: str, params: Dict[str, int], args: argparse.Namespace) -> Dict[str, object]:
+    with tempfile.TemporaryDirectory(prefix="bcr_bench_") as tmp:
+        root = pathlib.Path(tmp)
+        module_file = _generate_registry(root / "registry", seed=args.seed, **params)
+        server = _LatencyServer(root / "registry", args.latency_ms / 1000, args.jitter_ms / 1000, seed=args.seed)
+        try:
+            results: Dict[str, object] = {}
+            for command in args.command or COMMANDS:
+                argv = _command_argv(command, module_file, f"{server.url}/modules")
+                runs = []
+                for i in range(args.repeat):
+                    # Cold: empty caches; warm: the same cache directory again.
+                    cache_home = root / f"cache-{command}-{i}"
+                    runs.append((_time_command(argv, cache_home, server), _time_command(argv, cache_home, server)))
+                cold = min((run[0] for run in runs), key=lambda r: r["seconds"])
+                warm = min((run[1] for run in runs), key=lambda r: r["seconds"])
+                results[command] = {
+                    "cold_seconds": cold["seconds"],
+                    "cold_requests": cold["requests"],
+                    "warm_seconds": warm["seconds"],
+                    "warm_requests": warm["requests"],
+                }
+                print(f"{name} {command}: cold {cold['seconds']:.3f}s, warm {warm['seconds']:.3f}s", file=sys.stderr)
+        finally:
+            server.close()
+    return {"params": params, "results": results}
+
+
+def _compare(report: Dict[str, object], baseline: Dict[str, object], threshold: float) -> List[str]:
+    """Annotate `report` with ratios to `baseline`; return the slowdowns above `threshold`."""
+    regressions = []
+    for scale, current in report["scales"].items():  # type: ignore[union-attr]
+        previous = baseline.get("scales", {}).get(scale)  # type: ignore[union-attr]
+        if not previous or previous.get("params") != current["params"]:
+            continue
+        for command, timings in current["results"].items():
+            base = previous["results"].get(command)
+            if not base:
+                continue
+            for key in ("cold_seconds", "warm_seconds"):
+                ratio = timings[key] / base[key] if base[key] else float("inf")
+                timings[key.replace("seconds", "ratio")] = round(ratio, 2)
+                if ratio > threshold:
+                    change = f"{base[key]:.3f}s -> {timings[key]:.3f}s ({ratio:.2f}x)"
+                    regressions.append(f"{scale} {command} {key}: {change}")
+    return regressions
+
+
+def cmd_commands(args: argparse.Namespace) -> None:
+    if args.modules:
+        scales = {
+            "custom": {
+                "modules": args.modules,
+                "versions": args.versions,
+                "fanout": args.fanout,
+                "module_lines": args.module_lines,
+            }
+        }
+    else:
+        scales = {name: SCALES[name] for name in args.scale or ("small", "medium")}
+    report: Dict[str, object] = {
+        "latency_ms": args.latency_ms,
+        "jitter_ms": args.jitter_ms,
+        "repeat": args.repeat,
+        "python": sys.version.split()[0],
+        "scales": {name: _bench_scale(name, params, args) for name, params in scales.items()},
+    }
+    regressions: List[str] = []
+    if args.baseline:
+        baseline = json.loads(pathlib.Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = _compare(report, baseline, args.threshold)
+        report["regressions"] = regressions
+    text = json.dumps(report, indent=2)
+    if args.output:
+        pathlib.Path(args.output).write_text(text + "\n", encoding="utf-8")
+    print(text)
+    if regressions:
+        print("\n".join(f"regression: {line}" for line in regressions), file=sys.stderr)
+        raise SystemExit(1)
+
+
+def _time_cold_index(root: pathlib.Path, modules: int) -> float:
+    """Seconds for the first `RegistryIndex.refresh` of a generated registry with `modules` modules."""
+    registry = root / f"registry-{modules}"
+    _generate_registry(registry, modules=modules, versions=3, fanout=0, module_lines=1)
+    os.environ["XDG_CACHE_HOME"] = str(root / f"cache-{modules}")
+    start = time.perf_counter()
+    index = bcr_tool.RegistryIndex(str(registry))
+    index.refresh()
+    seconds = time.perf_counter() - start
+    index.db.close()
+    return seconds
+
+
+def cmd_index(args: argparse.Namespace) -> None:
+    sizes = (args.modules, args.modules * args.factor)
+    cache_home = os.environ.get("XDG_CACHE_HOME")
+    try:
+        with tempfile.TemporaryDirectory(prefix="bcr_bench_") as tmp:
+            seconds = [min(_time_cold_index(pathlib.Path(tmp) / str(i), n) for i in range(args.repeat)) for n in sizes]
+    finally:
+        if cache_home is None:
+            os.environ.pop("XDG_CACHE_HOME", None)
+        else:
+            os.environ["XDG_CACHE_HOME"] = cache_home
+    # Per-module cost at the larger size relative to the smaller one: ~1 for a linear build.
+    growth = (seconds[1] / sizes[1]) / (seconds[0] / sizes[0])
+    report = {
+        "modules": list(sizes),
+        "cold_seconds": [round(value, 4) for value in seconds],
+        "per_module_growth": round(growth, 2),
+    }
+    print(json.dumps(report, indent=2))
+    if growth > args.max_growth:
+        raise SystemExit(f"cold index build grows {growth:.2f}x per module from {sizes[0]} to {sizes[1]} modules")
+
+
+def _parse_args(argv: Sequence[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="bcr_tool benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scan = subparsers.add_parser("scan", help="Time MODULE.bazel scanning on a generated file")
+    scan.add_argument("--lines", type=int, default=50_000, help="Lines in the generated MODULE.bazel")
+    scan.add_argument("--repeat", type=int, default=3, help="Runs per implementation; the best is reported")
+    scan.add_argument("--skip-legacy", action="store_true", help="Do not time the legacy scanner")
+    scan.set_defaults(func=cmd_scan)
+
+    versions = subparsers.add_parser("versions", help="Time registry.py version sorting against the legacy Version class")
+    versions.add_argument("--count", type=int, default=50_000, help="Number of generated version strings")
+    versions.add_argument("--repeat", type=int, default=3, help="Runs per implementation; the best is reported")
+    versions.set_defaults(func=cmd_versions)
+
+    index = subparsers.add_parser(
+        "index", help="Check that the cold find/list-versions index build scales linearly with the module count"
+    )
+    index.add_argument("--modules", type=int, default=500, help="Modules in the smaller generated registry")
+    index.add_argument("--factor", type=int, default=4, help="The larger registry has this many times more modules")
+    index.add_argument("--repeat", type=int, default=3, help="Builds per size; the best is reported")
+    index.add_argument(
+        "--max-growth", type=float, default=2.0, help="Fail when the per-module cost grows more than this"
+    )
+    index.set_defaults(func=cmd_index)
+
+    commands = subparsers.add_parser(
+        "commands", help="Time bcr_tool commands against a generated registry served with injected latency"
+    )
+    commands.add_argument(
+        "--scale", action="append", choices=sorted(SCALES), help="Preset size (repeatable, default: small, medium)"
+    )
+    commands.add_argument("--modules", type=int, help="Custom scale: number of modules (overrides --scale)")
+    commands.add_argument("--versions", type=int, default=10, help="Custom scale: versions per module")
+    commands.add_argument("--fanout", type=int, default=5, help="Custom scale: bazel_deps per MODULE.bazel")
+    commands.add_argument("--module-lines", type=int, default=200, help="Custom scale: lines per MODULE.bazel")
+    commands.add_argument(
+        "--command", action="append", choices=COMMANDS, help="Command to time (repeatable, default: all)"
+    )
+    commands.add_argument("--latency-ms", type=float, default=20, help="Delay added to every registry request")
+    commands.add_argument("--jitter-ms", type=float, default=5, help="Uniform random +/- variation of the delay")
+    commands.add_argument(
+        "--repeat", type=int, default=1, help="Cold/warm run pairs per command; the best is reported"
+    )
+    commands.add_argument("--seed", type=int, default=0, help="Seed for the generated registry and jitter")
+    commands.add_argument("--output", help="Also write the JSON report to this file")
+    commands.add_argument("--baseline", help="Earlier JSON report to compare against")
+    commands.add_argument(
+        "--threshold", type=float, default=1.25, help="Slowdown ratio against --baseline reported as a regression"
+    )
+    commands.set_defaults(func=cmd_commands)
+
+    return parser.parse_args(argv)
+
+
+def main(argv: Sequence[str]) -> int:
+    args = _parse_args(argv)
+    args.func(args)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
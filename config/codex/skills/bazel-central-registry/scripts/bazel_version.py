@@ -0,0 +1,42 @@
+"""Bazel module version ordering, shared by bcr_tool.py and registry.py.
+
+Stdlib only, so bcr_tool.py can use it without PyYAML.
+"""
+
+from __future__ import annotations
+
+import functools
+import re
+from typing import Tuple
+
+VERSION_PATTERN = re.compile(r"^([a-zA-Z0-9.]+)(?:-([a-zA-Z0-9.-]+))?(?:\+[a-zA-Z0-9.-]+)?$")
+# Comfortably above the number of versions in the BCR, so a long-running
+# process (`verify`, a `serve` daemon) stays fast without growing forever.
+VERSION_KEY_CACHE_SIZE = 1 << 16
+
+
+def _identifiers_key(part: str) -> Tuple[Tuple[int, object], ...]:
+    identifiers = part.split(".")
+    if "" in identifiers:
+        raise ValueError("identifier is empty")
+    return tuple((0, int(i)) if i.isdigit() else (1, i) for i in identifiers)
+
+
+@functools.lru_cache(maxsize=VERSION_KEY_CACHE_SIZE)
+def version_key(version: str) -> Tuple[object, ...]:
+    """Plain tuple sort key matching Bazel's module `Version` ordering.
+
+    Release identifiers compare first, as (0, int) or (1, str) pairs so
+    numeric identifiers sort before alphanumeric ones; a version without a
+    prerelease suffix sorts after any prerelease of the same release. The
+    empty version (used by non-registry overrides) sorts after everything
+    else. Raises ValueError for anything else that is not a valid version.
+    """
+    if not version:
+        return (1,)
+    match = VERSION_PATTERN.match(version)
+    if not match:
+        raise ValueError(f"`{version}` is not a valid version")
+    release, prerelease = match.groups()
+    prerelease_key = (1,) if prerelease is None else (0, _identifiers_key(prerelease))
+    return (0, _identifiers_key(release), prerelease_key)
@@ -7,20 +7,80 @@ This script is intended for use by the bazel-central-registry skill.
 from __future__ import annotations
 
 import argparse
+import bisect
+import contextlib
 import difflib
+import fnmatch
+import functools
+import hashlib
+import http.client
+import io
 import json
+import mmap
+import os
 import pathlib
 import re
+import shutil
+import socket
+import socketserver
+import sqlite3
+import struct
+import subprocess
 import sys
+import tempfile
+import threading
+import time
+import traceback
 import urllib.error
+import urllib.parse
 import urllib.request
-from dataclasses import dataclass
-from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import zlib
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple, Union
+
+from bazel_version import version_key
 
 DEFAULT_REGISTRY_URL = "https://bcr.bazel.build/modules"
+DEFAULT_JOBS = 8
+HTTP_TIMEOUT = 20
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+DEFAULT_CACHE_TTL = 300
+DEFAULT_CACHE_MAX_MB = 64
+# Read-only queries a `serve` daemon may run; anything that writes files or runs long batches stays in-process.
+DAEMON_COMMANDS = frozenset(
+    ("latest", "list-deps", "deps-tree", "resolve", "check-upgrades", "upgrade", "diff-versions", "find", "list-versions",
+     "rdeps", "changes")
+)
+# Environment a daemon's answers depend on; a client whose values differ runs in-process.
+DAEMON_ENV_VARS = frozenset(
+    ("HOME", "XDG_CACHE_HOME", "NETRC", "SSL_CERT_FILE", "SSL_CERT_DIR", "http_proxy", "https_proxy", "no_proxy",
+     "all_proxy")
+)
+DAEMON_CONNECT_TIMEOUT = 1.0
+DAEMON_RUN_TIMEOUT = 600.0
+FUZZY_FIELDS = ("name", "homepage", "maintainers")
+FUZZY_FIELD_WEIGHT = 0.8
+FUZZY_MIN_SCORE = 0.2
 
 INCLUDE_RE = re.compile(r"include\(\s*([\"'])([^\"']+)\1\s*\)")
 PRERELEASE_RE = re.compile(r"-(?:rc|alpha|beta|pre)\d*", re.IGNORECASE)
+NEWLINE_RE = re.compile(r"\n")
+CALL_TOKEN_RE = re.compile(
+    r"""
+    (?P<comment>\#[^\n]*)
+    | (?P<string>\"\"\"(?:\\.|[^\\])*?\"\"\"|'''(?:\\.|[^\\])*?'''|"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')
+    | (?P<kwarg>\b(?P<key>[A-Za-z_]\w*)\s*=(?!=)\s*
+        (?:"(?P<dq>[^"\\\n]+)"|'(?P<sq>[^'\\\n]+)'|(?P<number>-?\d+)\b|(?P<boolean>True|False)\b))
+    | \b(?P<call>[A-Za-z_]\w*)\s*\(
+    | (?P<open>\()
+    | (?P<close>\))
+    """,
+    re.VERBOSE,
+)
+MODULE_CALLS = ("module", "bazel_dep", "single_version_override", "archive_override", "include")
 
 
 @dataclass
@@ -30,6 +90,13 @@ class Dep:
     file: pathlib.Path
     call: str
     line: int
+    dev_dependency: bool = False
+
+
+@dataclass
+class ModuleInfo:
+    deps: List[Dep] = field(default_factory=list)
+    compatibility_level: int = 0
 
 
 @dataclass
@@ -55,131 +122,1112 @@ def _resolve_label(label: str, workspace_root: pathlib.Path, current_dir: pathli
     return workspace_root / label
 
 
-def _collect_module_files(root_module: pathlib.Path, workspace_root: pathlib.Path) -> List[pathlib.Path]:
-    seen: Dict[pathlib.Path, None] = {}
+@dataclass
+class Call:
+    name: str
+    start: int
+    end: int
+    line: int
+    kwargs: Dict[str, object]
+    # kwarg -> (start, end) offsets of the contents of its string literal
+    spans: Dict[str, Tuple[int, int]] = field(default_factory=dict)
+
+
+class _LineTable:
+    """Maps offsets to 1-based line numbers by bisecting precomputed line starts."""
+
+    def __init__(self, text: str) -> None:
+        self.starts = [0]
+        self.starts.extend(match.end() for match in NEWLINE_RE.finditer(text))
+
+    def line(self, offset: int) -> int:
+        return bisect.bisect_right(self.starts, offset)
+
+
+def _tokenize_calls(text: str, names: Iterable[str] = MODULE_CALLS) -> List[Call]:
+    """Extract every call to one of `names` from Starlark `text` in one pass.
+
+    Comments and string literals are skipped, so commented-out calls, call
+    names inside strings and commented-out arguments are ignored. Keyword
+    arguments with a plain string, integer or boolean value are recorded for
+    the call they directly belong to, the first one winning, together with
+    the span of string values so they can be edited in place. Calls are
+    returned in source order.
+    """
+    wanted = frozenset(names)
+    calls: List[Call] = []
+    lines: Optional[_LineTable] = None
+    stack: List[Optional[Call]] = []
+    for match in CALL_TOKEN_RE.finditer(text):
+        kind = match.lastgroup
+        if kind == "kwarg":
+            call = stack[-1] if stack else None
+            key = match.group("key")
+            if call is None or key in call.kwargs:
+                continue
+            quote = "dq" if match.group("dq") is not None else "sq"
+            if match.group(quote) is not None:
+                call.kwargs[key] = match.group(quote)
+                call.spans[key] = match.span(quote)
+            elif match.group("number") is not None:
+                call.kwargs[key] = int(match.group("number"))
+            else:
+                call.kwargs[key] = match.group("boolean") == "True"
+        elif kind == "call":
+            name = match.group("call")
+            stack.append(Call(name=name, start=match.start(), end=-1, line=0, kwargs={}) if name in wanted else None)
+        elif kind == "open":
+            stack.append(None)
+        elif kind == "close" and stack:
+            call = stack.pop()
+            if call is None:
+                continue
+            if lines is None:
+                lines = _LineTable(text)
+            call.end = match.end()
+            call.line = lines.line(call.start)
+            calls.append(call)
+    calls.sort(key=lambda call: call.start)
+    return calls
+
+
+def _calls_to_deps(calls: Iterable[Call], file_path: pathlib.Path, call_name: str, name_key: str) -> List[Dep]:
+    deps: List[Dep] = []
+    for call in calls:
+        if call.name != call_name:
+            continue
+        name = call.kwargs.get(name_key)
+        if not isinstance(name, str):
+            continue
+        version = call.kwargs.get("version")
+        deps.append(
+            Dep(
+                name=name,
+                version=version if isinstance(version, str) else None,
+                file=file_path,
+                call=call_name,
+                line=call.line,
+                dev_dependency=call.kwargs.get("dev_dependency") is True,
+            )
+        )
+    return deps
+
+
+def _parse_deps_from_text(text: str, file_path: pathlib.Path) -> List[Dep]:
+    return _calls_to_deps(_tokenize_calls(text, ("bazel_dep",)), file_path, "bazel_dep", "name")
+
+
+def _parse_module_info(text: str, file_path: pathlib.Path) -> ModuleInfo:
+    calls = _tokenize_calls(text, ("module", "bazel_dep"))
+    level = next((call.kwargs.get("compatibility_level") for call in calls if call.name == "module"), None)
+    return ModuleInfo(
+        deps=_calls_to_deps(calls, file_path, "bazel_dep", "name"),
+        compatibility_level=level if isinstance(level, int) else 0,
+    )
+
+
+def _load_text(path: pathlib.Path) -> str:
+    return path.read_text(encoding="utf-8")
+
+
+def _write_texts_atomically(texts: Dict[pathlib.Path, str]) -> None:
+    """Replace several files so that either all of them change or none do.
+
+    Every new file is first written to a temporary file in its target's
+    directory, and every target gets a backup (a hard link where possible)
+    before anything is renamed into place. If writing or renaming fails
+    partway, the files already replaced are restored from their backups and
+    all temporary files are removed. This protects against errors, not
+    against the process being killed mid-way.
+    """
+    staged: List[Tuple[str, pathlib.Path]] = []
+    backups: List[Tuple[str, pathlib.Path]] = []
+    replaced: List[Tuple[str, pathlib.Path]] = []
+    try:
+        for path, text in texts.items():
+            fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+            staged.append((tmp, path))
+            with os.fdopen(fd, "w", encoding="utf-8", newline="\n") as f:
+                f.write(text)
+            shutil.copymode(path, tmp)
+        for tmp, path in staged:
+            # Named after the unique temporary file, so it cannot clash either.
+            backup = f"{tmp}.bak"
+            backups.append((backup, path))
+            try:
+                os.link(path, backup)
+            except OSError:
+                shutil.copy2(path, backup)
+        for (tmp, path), backup in zip(staged, backups):
+            os.replace(tmp, path)
+            replaced.append(backup)
+    except BaseException:
+        for backup, path in reversed(replaced):
+            os.replace(backup, path)
+        for tmp, _ in staged + backups:
+            pathlib.Path(tmp).unlink(missing_ok=True)
+        raise
+    for backup, _ in backups:
+        pathlib.Path(backup).unlink(missing_ok=True)
+
+
+class ModuleFile:
+    """One MODULE.bazel fragment, read and tokenized at most once per run.
+
+    The include walk, scanning and upgrade planning all share the same
+    instance. When it comes from a `ModuleFileCache` hit, `calls` and
+    `includes` are already known and `text` is only read if an upgrade needs
+    to rewrite the file.
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        size: int,
+        mtime_ns: int,
+        calls: Optional[List[Call]] = None,
+        includes: Optional[List[str]] = None,
+    ) -> None:
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self._text: Optional[str] = None
+        self._calls = calls
+        self._includes = includes
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = _load_text(self.path)
+        return self._text
+
+    @property
+    def calls(self) -> List[Call]:
+        if self._calls is None:
+            self._calls = _tokenize_calls(self.text)
+        return self._calls
+
+    @property
+    def includes(self) -> List[str]:
+        """Labels of the `include()` calls, in source order."""
+        if self._includes is None:
+            self._includes = []
+            for call in self.calls:
+                match = INCLUDE_RE.match(self.text, call.start) if call.name == "include" else None
+                if match:
+                    self._includes.append(match.group(2))
+        return self._includes
+
+
+class ModuleFileCache:
+    """Tokenized MODULE.bazel fragments kept between runs.
+
+    Entries live under `$XDG_CACHE_HOME/bcr_tool/module-files`, one JSON file
+    per path, and are only used while the file's size and mtime_ns match.
+    """
+
+    FORMAT = 2
+
+    def __init__(self, root: pathlib.Path) -> None:
+        self.root = root
+        # Files loaded or saved by this process; keeps a `serve` daemon off the disk.
+        self._memory: Dict[pathlib.Path, ModuleFile] = {}
+
+    def _entry_path(self, path: pathlib.Path) -> pathlib.Path:
+        return self.root / (hashlib.sha256(str(path).encode("utf-8")).hexdigest()[:32] + ".json")
+
+    def load(self, path: pathlib.Path, stat: os.stat_result) -> Optional[ModuleFile]:
+        module_file = self._memory.get(path)
+        if module_file and (module_file.size, module_file.mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+            return module_file
+        module_file = self._load_entry(path, stat)
+        if module_file:
+            self._memory[path] = module_file
+        return module_file
+
+    def _load_entry(self, path: pathlib.Path, stat: os.stat_result) -> Optional[ModuleFile]:
+        try:
+            entry = json.loads(self._entry_path(path).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or (
+            entry.get("format"),
+            entry.get("path"),
+            entry.get("size"),
+            entry.get("mtime_ns"),
+        ) != (self.FORMAT, str(path), stat.st_size, stat.st_mtime_ns):
+            return None
+        calls = [
+            Call(name=name, start=start, end=end, line=line, kwargs=kwargs, spans={k: tuple(v) for k, v in spans.items()})
+            for name, start, end, line, kwargs, spans in entry["calls"]
+        ]
+        return ModuleFile(path, stat.st_size, stat.st_mtime_ns, calls=calls, includes=entry["includes"])
+
+    def save(self, module_file: ModuleFile) -> None:
+        self._memory[module_file.path] = module_file
+        entry = {
+            "format": self.FORMAT,
+            "path": str(module_file.path),
+            "size": module_file.size,
+            "mtime_ns": module_file.mtime_ns,
+            "calls": [[call.name, call.start, call.end, call.line, call.kwargs, call.spans] for call in module_file.calls],
+            "includes": module_file.includes,
+        }
+        try:
+            _atomic_write_bytes(self._entry_path(module_file.path), json.dumps(entry).encode("utf-8"))
+        except OSError:
+            pass  # The cache is an optimization only.
+
+
+@functools.lru_cache(maxsize=None)
+def _module_file_cache_at(root: pathlib.Path) -> ModuleFileCache:
+    return ModuleFileCache(root)
+
+
+def _module_file_cache() -> ModuleFileCache:
+    return _module_file_cache_at(_cache_home() / "module-files")
+
+
+def _collect_module_files(
+    root_module: pathlib.Path, workspace_root: pathlib.Path, cache: Optional[ModuleFileCache] = None
+) -> Dict[pathlib.Path, ModuleFile]:
+    """Load `root_module` and every file it transitively `include()`s, once each."""
+    files: Dict[pathlib.Path, ModuleFile] = {}
     stack = [root_module]
 
     while stack:
         path = stack.pop().resolve()
-        if path in seen:
-            continue
-        seen[path] = None
-        if not path.exists():
+        if path in files:
             continue
-        content = path.read_text(encoding="utf-8")
-        for _, label in INCLUDE_RE.findall(content):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            raise SystemExit(f"Module file not found: {path}") from None
+        module_file = cache.load(path, stat) if cache else None
+        if module_file is None:
+            module_file = ModuleFile(path, stat.st_size, stat.st_mtime_ns)
+            if cache:
+                cache.save(module_file)
+        files[path] = module_file
+        for label in module_file.includes:
             include_path = _resolve_label(label, workspace_root, path.parent)
             if include_path.exists():
                 stack.append(include_path)
-    return list(seen.keys())
+    return files
 
 
-def _extract_calls(text: str, call_name: str) -> Iterable[Tuple[int, int, str]]:
-    pattern = re.compile(rf"\b{re.escape(call_name)}\s*\(")
-    idx = 0
-    while True:
-        match = pattern.search(text, idx)
-        if not match:
-            break
-        start = match.start()
-        i = match.end() - 1
-        depth = 0
-        in_str: Optional[str] = None
-        escape = False
-        while i < len(text):
-            ch = text[i]
-            if in_str:
-                if escape:
-                    escape = False
-                elif ch == "\\":
-                    escape = True
-                elif ch == in_str:
-                    in_str = None
-            else:
-                if ch in ("\"", "'"):
-                    in_str = ch
-                elif ch == "(":
-                    depth += 1
-                elif ch == ")":
-                    depth -= 1
-                    if depth == 0:
-                        end = i + 1
-                        yield start, end, text[start:end]
-                        idx = end
-                        break
-            i += 1
-        else:
-            break
+@dataclass
+class HttpResponse:
+    url: str
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+
+
+class HttpSession:
+    """HTTP client that keeps one keep-alive connection per host and thread.
+
+    Plain `http`/`https` URLs go through pooled `http.client` connections so
+    that many requests to the registry host share TLS handshakes. Other
+    schemes (such as `file://`) and proxied hosts fall back to urllib.
+    """
+
+    def __init__(self, timeout: float = HTTP_TIMEOUT) -> None:
+        self.timeout = timeout
+        self._local = threading.local()
+        self._proxies = urllib.request.getproxies()
+
+    def _connections(self) -> Dict[Tuple[str, str], http.client.HTTPConnection]:
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        return connections
+
+    def _uses_urllib(self, parts: urllib.parse.SplitResult) -> bool:
+        if parts.scheme not in ("http", "https"):
+            return True
+        return parts.scheme in self._proxies and not urllib.request.proxy_bypass(parts.hostname or "")
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None) -> HttpResponse:
+        """GET `url`, following redirects. Non-2xx responses are returned, not raised."""
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(url)
+            if self._uses_urllib(parts):
+                return self._get_urllib(url, headers)
+            response = self._get_pooled(parts, url, headers)
+            location = response.headers.get("location")
+            if response.status not in REDIRECT_STATUSES or not location:
+                return response
+            url = urllib.parse.urljoin(url, location)
+        raise urllib.error.URLError(f"Too many redirects: {url}")
+
+    def _get_pooled(
+        self,
+        parts: urllib.parse.SplitResult,
+        url: str,
+        headers: Optional[Dict[str, str]],
+    ) -> HttpResponse:
+        key = (parts.scheme, parts.netloc)
+        connections = self._connections()
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+        request_headers = {"User-Agent": "bcr_tool", "Accept-Encoding": "identity"}
+        request_headers.update(headers or {})
+
+        for attempt in range(2):
+            connection = connections.get(key)
+            reused = connection is not None
+            if connection is None:
+                connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+                connection = connection_class(parts.netloc, timeout=self.timeout)
+                connections[key] = connection
+            try:
+                connection.request("GET", path, headers=request_headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, ConnectionError, OSError):
+                connection.close()
+                connections.pop(key, None)
+                # A pooled connection may have been closed by the server while idle.
+                if reused and attempt == 0:
+                    continue
+                raise
+            if response.will_close:
+                connection.close()
+                connections.pop(key, None)
+            response_headers = {name.lower(): value for name, value in response.getheaders()}
+            return HttpResponse(url=url, status=response.status, headers=response_headers, body=body)
+        raise AssertionError("unreachable")
+
+    def _get_urllib(self, url: str, headers: Optional[Dict[str, str]]) -> HttpResponse:
+        request = urllib.request.Request(url, headers=headers or {})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response_headers = {name.lower(): value for name, value in response.headers.items()}
+                return HttpResponse(url=url, status=response.status or 200, headers=response_headers, body=response.read())
+        except urllib.error.HTTPError as err:
+            response_headers = {name.lower(): value for name, value in (err.headers or {}).items()}
+            return HttpResponse(url=url, status=err.code, headers=response_headers, body=err.read())
 
 
-def _find_kwarg_string(block: str, key: str) -> Optional[str]:
-    match = re.search(rf"\b{re.escape(key)}\s*=\s*([\"'])([^\"']+)\1", block)
-    if not match:
-        return None
-    return match.group(2)
+def _raise_for_status(response: HttpResponse) -> None:
+    if response.status >= 400:
+        raise urllib.error.HTTPError(response.url, response.status, f"HTTP {response.status}", None, None)
 
 
-def _replace_version(block: str, new_version: str) -> str:
-    pattern = re.compile(r"(\bversion\s*=\s*)([\"'])([^\"']+)(\2)")
-    return pattern.sub(lambda m: f"{m.group(1)}{m.group(2)}{new_version}{m.group(2)}", block, count=1)
+class OfflineError(urllib.error.URLError):
+    """Raised when `--offline` is set and a URL has no cached response."""
 
 
-def _line_number_for_offset(text: str, offset: int) -> int:
-    return text.count("\n", 0, offset) + 1
+def _cache_home() -> pathlib.Path:
+    base = os.environ.get("XDG_CACHE_HOME") or str(pathlib.Path.home() / ".cache")
+    return pathlib.Path(base) / "bcr_tool"
 
 
-def _parse_named_calls(text: str, file_path: pathlib.Path, call_name: str, name_key: str) -> List[Dep]:
-    deps: List[Dep] = []
-    for start, _, block in _extract_calls(text, call_name):
-        name = _find_kwarg_string(block, name_key)
-        if not name:
-            continue
-        deps.append(
-            Dep(
-                name=name,
-                version=_find_kwarg_string(block, "version"),
-                file=file_path,
-                call=call_name,
-                line=_line_number_for_offset(text, start),
-            )
+def _atomic_write_bytes(path: pathlib.Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        pathlib.Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+@dataclass
+class CacheEntry:
+    url: str
+    body: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+    status: int = 200
+
+
+class HttpCache:
+    """Persistent cache of registry responses under `$XDG_CACHE_HOME/bcr_tool/http`.
+
+    Each entry keeps the body next to a small JSON header with the validators
+    (`ETag`, `Last-Modified`) and the time it was last confirmed fresh. 404s are
+    cached too so missing modules do not cost a request per run. Entries
+    younger than `ttl` seconds are served without a request; older ones are
+    revalidated with a conditional GET. The access time of the header file
+    tracks recency for LRU eviction once the cache grows past `max_bytes`.
+    """
+
+    def __init__(self, root: pathlib.Path, ttl: float = DEFAULT_CACHE_TTL, max_bytes: int = DEFAULT_CACHE_MAX_MB << 20) -> None:
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._dirty = False
+
+    def _paths(self, url: str) -> Tuple[pathlib.Path, pathlib.Path]:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        base = self.root / key[:2] / key
+        return base.with_suffix(".json"), base.with_suffix(".body")
+
+    def lookup(self, url: str) -> Optional[CacheEntry]:
+        meta_path, body_path = self._paths(url)
+        try:
+            meta = json.loads(meta_path.read_bytes())
+            body = body_path.read_bytes()
+        except (OSError, ValueError):
+            return None
+        if meta.get("url") != url or meta.get("size") != len(body):
+            return None
+        try:
+            os.utime(meta_path)
+        except OSError:
+            pass  # Evicted by another process since the read; the body in hand is still valid.
+        return CacheEntry(
+            url=url,
+            body=body,
+            etag=meta.get("etag"),
+            last_modified=meta.get("last_modified"),
+            fetched_at=meta.get("fetched_at", 0.0),
+            status=meta.get("status", 200),
         )
-    return deps
 
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        return time.time() - entry.fetched_at < self.ttl
+
+    def _write_meta(self, url: str, size: int, etag: Optional[str], last_modified: Optional[str], status: int) -> None:
+        meta = {
+            "url": url,
+            "status": status,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": time.time(),
+            "size": size,
+        }
+        _atomic_write_bytes(self._paths(url)[0], json.dumps(meta).encode("utf-8"))
+        self._dirty = True
+
+    def store(self, response: HttpResponse) -> None:
+        body = response.body if response.status == 200 else b""
+        _atomic_write_bytes(self._paths(response.url)[1], body)
+        self._write_meta(
+            response.url,
+            len(body),
+            response.headers.get("etag"),
+            response.headers.get("last-modified"),
+            response.status,
+        )
 
-def _parse_deps_from_text(text: str, file_path: pathlib.Path) -> List[Dep]:
-    return _parse_named_calls(text, file_path, "bazel_dep", "name")
+    def refresh(self, entry: CacheEntry) -> None:
+        """Mark `entry` fresh again after the server answered 304 Not Modified."""
+        self._write_meta(entry.url, len(entry.body), entry.etag, entry.last_modified, entry.status)
+
+    def evict(self) -> None:
+        """Drop least recently used entries until the cache fits in `max_bytes`."""
+        if not self._dirty or not self.root.is_dir():
+            return
+        self._dirty = False
+        entries = []
+        total = 0
+        for meta_path in self.root.glob("*/*.json"):
+            body_path = meta_path.with_suffix(".body")
+            try:
+                meta_stat = meta_path.stat()
+                size = meta_stat.st_size + body_path.stat().st_size
+                used = meta_stat.st_mtime
+            except OSError:
+                continue
+            entries.append((used, meta_path, body_path, size))
+            total += size
+        for _, meta_path, body_path, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            meta_path.unlink(missing_ok=True)
+            body_path.unlink(missing_ok=True)
+            total -= size
+
+
+class RegistryBackend:
+    """Where registry files come from, addressed by their registry URL.
+
+    Subclasses implement `_get`. Concurrent requests for the same URL are
+    merged into one, and `get_many` fans out over up to `jobs` worker threads
+    that live as long as the backend.
+    """
+
+    def __init__(self, jobs: int = DEFAULT_JOBS) -> None:
+        self.jobs = max(1, jobs)
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._inflight: Dict[Tuple[str, bool], Future] = {}
+
+    def namespace(self, registry_url: str) -> Optional[str]:
+        """Key under which published files read through this backend are stored in the `ModuleStore`.
+
+        None keeps them out of the store: local files are cheap to re-read
+        and can change without their module version changing.
+        """
+        return registry_url.rstrip("/")
+
+    def list_modules(self) -> Optional[List[str]]:
+        """Every module name in the registry, or None if the backend cannot enumerate them."""
+        return None
 
+    def get(self, url: str, use_cache: bool = True) -> bytes:
+        key = (url, use_cache)
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            body = self._get(url, use_cache)
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        else:
+            future.set_result(body)
+            return body
+        finally:
+            with self._lock:
+                del self._inflight[key]
 
-def _parse_overrides_from_text(text: str, file_path: pathlib.Path) -> List[Dep]:
-    return _parse_named_calls(text, file_path, "single_version_override", "module_name")
+    def _get(self, url: str, use_cache: bool) -> bytes:
+        raise NotImplementedError
 
+    def _try_get(self, url: str, use_cache: bool = True) -> Union[bytes, Exception]:
+        try:
+            return self.get(url, use_cache)
+        except Exception as err:
+            return err
+
+    def get_many(self, urls: Sequence[str], use_cache: bool = True) -> Dict[str, Union[bytes, Exception]]:
+        """Fetch `urls` concurrently. Each value is the body or the exception raised for it."""
+        unique = list(dict.fromkeys(urls))
+        if len(unique) <= 1 or self.jobs == 1:
+            return {url: self._try_get(url, use_cache) for url in unique}
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix="bcr-fetch")
+        bodies = self._pool.map(lambda url: self._try_get(url, use_cache), unique)
+        return dict(zip(unique, bodies))
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+class Fetcher(RegistryBackend):
+    """Fetches registry files over HTTP through a shared `HttpSession`.
+
+    Worker threads keep their keep-alive connections across batches. With a
+    `cache`, fresh entries are answered locally, stale ones are revalidated,
+    and `offline` answers only from cache.
+    """
+
+    def __init__(
+        self,
+        session: Optional[HttpSession] = None,
+        jobs: int = DEFAULT_JOBS,
+        cache: Optional[HttpCache] = None,
+        offline: bool = False,
+    ) -> None:
+        super().__init__(jobs)
+        self.session = session or HttpSession()
+        self.cache = cache
+        self.offline = offline
+
+    def _get(self, url: str, use_cache: bool) -> bytes:
+        cache = self.cache if use_cache else None
+        entry = cache.lookup(url) if cache else None
+        if entry and (self.offline or cache.is_fresh(entry)):
+            return self._cached_body(entry)
+        if self.offline:
+            raise OfflineError(f"No cached response for {url} (--offline)")
+
+        headers: Dict[str, str] = {}
+        if entry and entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry and entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        response = self.session.get(url, headers)
+        if entry and response.status == 304:
+            cache.refresh(entry)
+            return self._cached_body(entry)
+        if cache and response.status in (200, 404):
+            response.url = url
+            cache.store(response)
+        _raise_for_status(response)
+        return response.body
+
+    @staticmethod
+    def _cached_body(entry: CacheEntry) -> bytes:
+        _raise_for_status(HttpResponse(url=entry.url, status=entry.status, headers={}, body=b""))
+        return entry.body
+
+    def close(self) -> None:
+        super().close()
+        if self.cache:
+            self.cache.evict()
+
+
+SNAPSHOT_MAGIC = b"BCRSNAP1"
+SNAPSHOT_HEADER = struct.Struct("<8sQQ")  # magic, index offset, index size
+
+
+class SnapshotBundle:
+    """Read-only, memory-mapped bundle of registry files.
+
+    Layout: a fixed header (magic, offset and size of the index), the
+    zlib-compressed files back to back, then the zlib-compressed JSON index
+    mapping each registry-relative path (`<module>/metadata.json`, and with
+    module files `<module>/<version>/MODULE.bazel`) to its blob. Opening a
+    bundle only inflates the index; files are inflated on demand.
+    """
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        try:
+            with open(path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as err:
+            raise SystemExit(f"Cannot open snapshot {path}: {err}") from None
+        try:
+            magic, offset, size = SNAPSHOT_HEADER.unpack_from(self._map)
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError("bad magic")
+            index = json.loads(zlib.decompress(self._map[offset : offset + size]))
+        except (struct.error, ValueError, zlib.error):
+            raise SystemExit(f"Not a bcr_tool snapshot: {path}") from None
+        self.info: Dict[str, object] = index["info"]
+        self._entries: Dict[str, List[int]] = index["entries"]
+
+    def get(self, name: str) -> Optional[bytes]:
+        entry = self._entries.get(name)
+        if entry is None:
+            return None
+        offset, size = entry
+        return zlib.decompress(self._map[offset : offset + size])
+
+    def names(self) -> List[str]:
+        return sorted(self._entries)
+
+    def close(self) -> None:
+        self._map.close()
+
+    @staticmethod
+    def write(path: pathlib.Path, files: Iterable[Tuple[str, bytes]], info: Dict[str, object]) -> Tuple[int, int]:
+        """Write a bundle atomically; returns the number of files and the bundle size."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        entries: Dict[str, List[int]] = {}
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(b"\0" * SNAPSHOT_HEADER.size)
+                for name, data in files:
+                    blob = zlib.compress(data, 9)
+                    entries[name] = [out.tell(), len(blob)]
+                    out.write(blob)
+                index = zlib.compress(json.dumps({"info": info, "entries": entries}).encode("utf-8"), 9)
+                offset = out.tell()
+                out.write(index)
+                out.seek(0)
+                out.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, offset, len(index)))
+                size = offset + len(index)
+            os.replace(tmp, path)
+        except BaseException:
+            pathlib.Path(tmp).unlink(missing_ok=True)
+            raise
+        return len(entries), size
+
+
+class _PathBackend(RegistryBackend):
+    """A backend holding the registry's files by relative path (`<module>/metadata.json`, ...).
+
+    URLs under `registry_url` map to those paths; anything else is answered
+    with a 404, as is a file the backend does not have.
+    """
+
+    def __init__(self, registry_url: str, jobs: int = 1) -> None:
+        super().__init__(jobs)
+        self.prefix = registry_url.rstrip("/") + "/"
+
+    def namespace(self, registry_url: str) -> Optional[str]:
+        return None
 
-def _parse_archive_overrides_from_text(text: str, file_path: pathlib.Path) -> List[Dep]:
-    return _parse_named_calls(text, file_path, "archive_override", "module_name")
+    def _read(self, name: str) -> Optional[bytes]:
+        raise NotImplementedError
 
+    def _get(self, url: str, use_cache: bool) -> bytes:
+        name = url[len(self.prefix) :] if url.startswith(self.prefix) else ""
+        parts = name.split("/")
+        body = None if not name or ".." in parts or "" in parts or "\n" in name else self._read(name)
+        if body is None:
+            raise urllib.error.HTTPError(url, 404, f"Not in {self}", None, None)  # type: ignore[arg-type]
+        return body
 
-def _load_text(path: pathlib.Path) -> str:
-    return path.read_text(encoding="utf-8")
 
+class SnapshotBackend(_PathBackend):
+    """Answers registry requests from a `SnapshotBundle`, never the network."""
+
+    def __init__(self, bundle: SnapshotBundle, registry_url: str) -> None:
+        super().__init__(registry_url)
+        self.bundle = bundle
+
+    def __str__(self) -> str:
+        return f"snapshot {self.bundle.path}"
+
+    def list_modules(self) -> Optional[List[str]]:
+        return [name[: -len("/metadata.json")] for name in self.bundle.names() if name.endswith("/metadata.json")]
+
+    def _read(self, name: str) -> Optional[bytes]:
+        if name.endswith("/MODULE.bazel") and not self.bundle.info.get("module_files"):
+            raise OfflineError(f"Snapshot {self.bundle.path} has no MODULE.bazel files; rebuild it with --module-files")
+        return self.bundle.get(name)
+
+    def close(self) -> None:
+        super().close()
+        self.bundle.close()
 
-def _write_text(path: pathlib.Path, text: str) -> None:
-    path.write_text(text, encoding="utf-8", newline="\n")
 
+class CheckoutBackend(_PathBackend):
+    """Reads registry files from the `modules/` directory of a local registry checkout."""
 
-def _load_json_url(url: str) -> Dict[str, object]:
-    with urllib.request.urlopen(url, timeout=20) as response:
-        return json.load(response)
+    def __init__(self, registry_path: str, registry_url: str, jobs: int = DEFAULT_JOBS) -> None:
+        super().__init__(registry_url, jobs)
+        self.modules_dir = _local_registry_modules_dir(registry_path).resolve()
 
+    def __str__(self) -> str:
+        return f"registry checkout {self.modules_dir.parent}"
 
-def _download_text_url(url: str) -> str:
-    with urllib.request.urlopen(url, timeout=20) as response:
-        return response.read().decode("utf-8")
+    def list_modules(self) -> Optional[List[str]]:
+        return sorted(entry.name for entry in os.scandir(self.modules_dir) if entry.is_dir())
+
+    def _read(self, name: str) -> Optional[bytes]:
+        try:
+            return (self.modules_dir / name).read_bytes()
+        except OSError:
+            return None
+
+
+def _git(repo: pathlib.Path, *args: str) -> str:
+    try:
+        return subprocess.run(["git", "-C", str(repo), *args], check=True, capture_output=True, text=True).stdout
+    except (OSError, subprocess.CalledProcessError) as err:
+        detail = getattr(err, "stderr", "") or err
+        raise SystemExit(f"git {args[0]} failed in {repo}: {str(detail).strip()}") from None
+
+
+def _git_commit(repo: pathlib.Path, rev: str) -> str:
+    return _git(repo, "rev-parse", "--verify", "--end-of-options", f"{rev}^{{commit}}").strip()
+
+
+class GitBackend(_PathBackend):
+    """Reads registry files from a git repository's object store at one commit.
+
+    Nothing is checked out: blobs `<commit>:modules/<path>` are streamed from
+    a single long-lived `git cat-file --batch` process, so a fork of the
+    registry can be queried at any revision, bare clones included. Requests
+    are serialized over that one pipe.
+    """
+
+    def __init__(self, repo: pathlib.Path, commit: str, registry_url: str) -> None:
+        super().__init__(registry_url)
+        self.repo = repo
+        self.commit = commit
+        self._process: Optional[subprocess.Popen] = None
+        self._pipe_lock = threading.Lock()
+
+    def __str__(self) -> str:
+        return f"{self.repo} at {self.commit[:12]}"
+
+    def list_modules(self) -> Optional[List[str]]:
+        output = _git(self.repo, "ls-tree", "-z", "--name-only", self.commit, "modules/")
+        return sorted(path[len("modules/") :] for path in output.split("\0") if path)
+
+    def _read(self, name: str) -> Optional[bytes]:
+        with self._pipe_lock:
+            if self._process is None:
+                self._process = subprocess.Popen(
+                    ["git", "-C", str(self.repo), "cat-file", "--batch"],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                )
+            assert self._process.stdin and self._process.stdout
+            self._process.stdin.write(f"{self.commit}:modules/{name}\n".encode("utf-8"))
+            self._process.stdin.flush()
+            header = self._process.stdout.readline()
+            if not header:
+                self._process = None
+                raise SystemExit(f"git cat-file exited unexpectedly in {self.repo}")
+            fields = header.split()
+            if len(fields) != 3:  # "<object> missing" or "ambiguous"
+                return None
+            data = self._process.stdout.read(int(fields[2]))
+            self._process.stdout.read(1)
+            return data if fields[1] == b"blob" else None
+
+    def close(self) -> None:
+        super().close()
+        if self._process is not None:
+            self._process.stdin.close()  # type: ignore[union-attr]
+            self._process.wait()
+            self._process = None
+
+
+_FETCHERS: Dict[Tuple[object, ...], RegistryBackend] = {}
+
+
+def _mtime_ns(path: pathlib.Path) -> int:
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return -1
+
+
+def _fetcher_from_args(args: argparse.Namespace) -> RegistryBackend:
+    """The backend selected by --snapshot, --git-registry, --registry-path, or else HTTP."""
+    jobs = getattr(args, "jobs", DEFAULT_JOBS)
+    use_cache = not getattr(args, "no_cache", False)
+    offline = getattr(args, "offline", False)
+    ttl = getattr(args, "cache_ttl", DEFAULT_CACHE_TTL)
+    max_mb = getattr(args, "cache_max_mb", DEFAULT_CACHE_MAX_MB)
+    registry_url = getattr(args, "registry_url", DEFAULT_REGISTRY_URL)
+    snapshot = getattr(args, "snapshot", None)
+    git_registry = getattr(args, "git_registry", None)
+    registry_path = getattr(args, "registry_path", None)
+    if snapshot:
+        path = pathlib.Path(snapshot).resolve()
+        # The mtime keeps a `serve` daemon from answering from a replaced bundle.
+        key: Tuple[object, ...] = ("snapshot", str(path), _mtime_ns(path), registry_url)
+        fetcher = _FETCHERS.get(key)
+        if fetcher is None:
+            fetcher = _FETCHERS[key] = SnapshotBackend(SnapshotBundle(path), registry_url)
+        return fetcher
+    if git_registry:
+        repo = pathlib.Path(git_registry).resolve()
+        # Keyed by commit, so a daemon follows a moving --git-rev such as a branch.
+        commit = _git_commit(repo, args.git_rev)
+        key = ("git", str(repo), commit, registry_url)
+        fetcher = _FETCHERS.get(key)
+        if fetcher is None:
+            fetcher = _FETCHERS[key] = GitBackend(repo, commit, registry_url)
+        return fetcher
+    if registry_path:
+        key = ("checkout", str(pathlib.Path(registry_path).resolve()), registry_url, jobs)
+        fetcher = _FETCHERS.get(key)
+        if fetcher is None:
+            fetcher = _FETCHERS[key] = CheckoutBackend(registry_path, registry_url, jobs)
+        return fetcher
+    key = (jobs, use_cache, offline, ttl, max_mb)
+    fetcher = _FETCHERS.get(key)
+    if fetcher is None:
+        if offline and not use_cache:
+            raise SystemExit("--offline requires the HTTP cache; drop --no-cache")
+        cache = HttpCache(_cache_home() / "http", ttl=ttl, max_bytes=max_mb << 20) if use_cache else None
+        fetcher = _FETCHERS[key] = Fetcher(jobs=jobs, cache=cache, offline=offline)
+    return fetcher
+
+
+def _close_fetchers() -> None:
+    for fetcher in _FETCHERS.values():
+        fetcher.close()
+    _FETCHERS.clear()
 
 
 def _metadata_url(module: str, registry_url: str) -> str:
     return f"{registry_url.rstrip('/')}/{module}/metadata.json"
 
 
+def _module_file_url(module: str, version: str, registry_url: str) -> str:
+    return f"{registry_url.rstrip('/')}/{module}/{version}/MODULE.bazel"
+
+
+class ModuleStore:
+    """Permanent store of published `MODULE.bazel` files and their parsed deps.
+
+    A module version never changes once published, so entries are keyed by
+    (registry, module, version) and never revalidated. Only files fetched
+    over HTTP are stored; checkouts, git objects and snapshots are read and
+    parsed afresh, since a fork's files can be edited in place. Each entry keeps the
+    raw file next to a `deps.json` with the parsed `bazel_dep` list and
+    compatibility level; reading the latter needs neither the network nor the
+    Starlark scanner. Entries written by an older format are re-parsed from the
+    raw file.
+    """
+
+    FORMAT = 3
+
+    def __init__(self, root: pathlib.Path) -> None:
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+
+    def _entry_dir(self, namespace: str, module: str, version: str) -> pathlib.Path:
+        registry_key = hashlib.sha256(namespace.rstrip("/").encode("utf-8")).hexdigest()[:16]
+        return self.root / registry_key / module / version
+
+    def load(
+        self, registry_url: str, module: str, version: str, namespace: Optional[str] = None
+    ) -> Optional[ModuleInfo]:
+        entry_dir = self._entry_dir(namespace or registry_url, module, version)
+        deps_path = entry_dir / "deps.json"
+        file_path = pathlib.Path(_module_file_url(module, version, registry_url))
+        try:
+            record = json.loads(deps_path.read_bytes())
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        if record.get("format") != self.FORMAT:
+            try:
+                text = (entry_dir / "MODULE.bazel").read_text(encoding="utf-8")
+            except OSError:
+                self.misses += 1
+                return None
+            info = _parse_module_info(text, file_path)
+            self.save(registry_url, module, version, text, info, namespace)
+            self.hits += 1
+            return info
+        os.utime(deps_path)
+        self.hits += 1
+        deps = [
+            Dep(
+                name=dep["name"],
+                version=dep["version"],
+                file=file_path,
+                call=dep["call"],
+                line=dep["line"],
+                dev_dependency=dep["dev_dependency"],
+            )
+            for dep in record["deps"]
+        ]
+        return ModuleInfo(deps=deps, compatibility_level=record["compatibility_level"])
+
+    def save(
+        self,
+        registry_url: str,
+        module: str,
+        version: str,
+        text: str,
+        info: ModuleInfo,
+        namespace: Optional[str] = None,
+    ) -> None:
+        entry_dir = self._entry_dir(namespace or registry_url, module, version)
+        record = {
+            "format": self.FORMAT,
+            "compatibility_level": info.compatibility_level,
+            "deps": [
+                {
+                    "name": dep.name,
+                    "version": dep.version,
+                    "call": dep.call,
+                    "line": dep.line,
+                    "dev_dependency": dep.dev_dependency,
+                }
+                for dep in info.deps
+            ],
+        }
+        _atomic_write_bytes(entry_dir / "MODULE.bazel", text.encode("utf-8"))
+        _atomic_write_bytes(entry_dir / "deps.json", json.dumps(record).encode("utf-8"))
+
+    def prune(self, older_than_days: float) -> Tuple[int, int]:
+        """Delete entries not read for `older_than_days`. Returns (entries, bytes) removed."""
+        cutoff = time.time() - older_than_days * 86400
+        removed = 0
+        removed_bytes = 0
+        for deps_path in self.root.glob("*/*/*/deps.json"):
+            entry_dir = deps_path.parent
+            try:
+                if deps_path.stat().st_mtime >= cutoff:
+                    continue
+            except OSError:
+                continue
+            for path in entry_dir.iterdir():
+                removed_bytes += path.stat().st_size
+                path.unlink()
+            entry_dir.rmdir()
+            removed += 1
+            for parent in (entry_dir.parent, entry_dir.parent.parent):
+                try:
+                    parent.rmdir()
+                except OSError:
+                    break
+        return removed, removed_bytes
+
+
+def _module_store() -> ModuleStore:
+    return ModuleStore(_cache_home() / "modules")
+
+
+def _load_module_infos(
+    keys: Sequence[Tuple[str, str]],
+    registry_url: str,
+    fetcher: RegistryBackend,
+    store: ModuleStore,
+) -> Dict[Tuple[str, str], Optional[ModuleInfo]]:
+    """Return the parsed `MODULE.bazel` of published module versions.
+
+    Store misses are downloaded concurrently. Versions whose file cannot be
+    fetched map to None. Backends without a store namespace skip the store.
+    """
+    results: Dict[Tuple[str, str], Optional[ModuleInfo]] = {}
+    urls: Dict[Tuple[str, str], str] = {}
+    namespace = fetcher.namespace(registry_url)
+    for module, version in keys:
+        info = store.load(registry_url, module, version, namespace) if namespace else None
+        if info is None:
+            urls[(module, version)] = _module_file_url(module, version, registry_url)
+        else:
+            results[(module, version)] = info
+    bodies = fetcher.get_many(list(urls.values()), use_cache=False)
+    for (module, version), url in urls.items():
+        body = bodies[url]
+        if isinstance(body, OfflineError):
+            raise body
+        if isinstance(body, Exception):
+            results[(module, version)] = None
+            continue
+        text = body.decode("utf-8")
+        info = _parse_module_info(text, pathlib.Path(url))
+        if namespace:
+            store.save(registry_url, module, version, text, info, namespace)
+        results[(module, version)] = info
+    return results
+
+
+def _all_versioned_deps(info: ModuleInfo) -> List[Tuple[str, str]]:
+    return [(dep.name, dep.version) for dep in info.deps if dep.version]
+
+
+def _expand_frontier(
+    roots: Iterable[Tuple[str, Optional[str]]],
+    max_depth: Optional[int],
+    registry_url: str,
+    fetcher: RegistryBackend,
+    store: ModuleStore,
+    edges: Callable[[ModuleInfo], Iterable[Tuple[str, str]]] = _all_versioned_deps,
+) -> Dict[Tuple[str, str], Optional[ModuleInfo]]:
+    """Load every (module, version) within `max_depth` levels of `roots`.
+
+    The graph is expanded breadth-first: all unseen versions of one level are
+    fetched in a single concurrent batch before moving on to the next level.
+    `edges` picks which deps of a loaded module are followed; `max_depth=None`
+    expands until no new versions are found.
+    """
+    infos: Dict[Tuple[str, str], Optional[ModuleInfo]] = {}
+    frontier = [(name, version) for name, version in roots if version]
+    depth = 0
+    while max_depth is None or depth < max_depth:
+        pending = [key for key in dict.fromkeys(frontier) if key not in infos]
+        if not pending:
+            break
+        infos.update(_load_module_infos(pending, registry_url, fetcher, store))
+        frontier = [edge for key in pending if infos[key] for edge in edges(infos[key])]
+        depth += 1
+    return infos
+
+
 def _pick_latest_version(
     versions: Sequence[str],
     yanked_versions: Sequence[str],
@@ -201,15 +1249,20 @@ def _latest_versions(
     names: Sequence[str],
     registry_url: str,
     *,
+    fetcher: RegistryBackend,
     include_prerelease: bool = False,
     include_yanked: bool = False,
 ) -> Dict[str, str]:
+    urls = {name: _metadata_url(name, registry_url) for name in names}
+    bodies = fetcher.get_many(list(urls.values()))
     results: Dict[str, str] = {}
     for name in names:
-        try:
-            metadata = _load_json_url(_metadata_url(name, registry_url))
-        except urllib.error.HTTPError:
+        body = bodies[urls[name]]
+        if isinstance(body, urllib.error.HTTPError):
             continue
+        if isinstance(body, Exception):
+            raise body
+        metadata = json.loads(body)
         latest = _pick_latest_version(
             metadata.get("versions", []),
             (metadata.get("yanked_versions") or {}).keys(),
@@ -228,22 +1281,256 @@ def _local_registry_modules_dir(registry_path: str) -> pathlib.Path:
     return modules_dir
 
 
-def _local_metadata(registry_path: str, module: str) -> Dict[str, object]:
-    path = _local_registry_modules_dir(registry_path) / module / "metadata.json"
-    if not path.exists():
-        raise SystemExit(f"Module not found in local registry: {module}")
-    return json.loads(path.read_text(encoding="utf-8"))
+def _trigrams(text: str) -> List[str]:
+    """Trigrams of each alphanumeric token of `text`, padded like pg_trgm.
+
+    Tokenizing first makes the grams independent of word order and of the
+    separators used (`rules_go`, `go-rules` and `rules go` share all grams).
+    """
+    grams: Dict[str, None] = {}
+    for token in re.findall(r"[a-z0-9]+", text.lower()):
+        padded = f"  {token} "
+        for i in range(len(padded) - 2):
+            grams[padded[i : i + 3]] = None
+    return list(grams)
+
+
+class RegistryIndex:
+    """SQLite index of the `modules/` tree of a local registry checkout.
+
+    The index lives under `$XDG_CACHE_HOME/bcr_tool/index`, one database per
+    checkout, and holds module names, homepages, maintainers, each module's
+    versions with their yanked flags, and a trigram index over the text
+    fields for fuzzy search. `refresh()` stats every module's `metadata.json`
+    and re-reads only those whose mtime or size changed, so in-place edits and
+    versions added by `RegistryClient.add` show up without a commit.
+
+    The reverse-dependency tables (`bazel_dep` edges of every version's
+    MODULE.bazel) are only built by `refresh_deps()`, which `rdeps` calls. It
+    tracks each (module, version) and re-parses only the MODULE.bazel files
+    whose mtime or size changed, so new and edited versions are picked up
+    without a commit.
+    """
+
+    SCHEMA = 6
+
+    def __init__(self, registry_path: str) -> None:
+        self.registry_path = pathlib.Path(registry_path).resolve()
+        self.modules_dir = _local_registry_modules_dir(registry_path)
+        key = hashlib.sha256(str(self.registry_path).encode("utf-8")).hexdigest()[:16]
+        db_path = _cache_home() / "index" / f"{key}.sqlite"
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(db_path)
+        self._create_schema()
+
+    def _create_schema(self) -> None:
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+            row = self.db.execute("SELECT value FROM state WHERE key = 'schema'").fetchone()
+            if row and row[0] == str(self.SCHEMA):
+                return
+            for table in ("modules", "versions", "fields", "trigrams", "dep_modules", "module_files", "deps"):
+                self.db.execute(f"DROP TABLE IF EXISTS {table}")
+            self.db.execute("DELETE FROM state")
+            self.db.execute(
+                "CREATE TABLE modules (name TEXT PRIMARY KEY, homepage TEXT, maintainers TEXT, "
+                "metadata_mtime_ns INTEGER, metadata_size INTEGER)"
+            )
+            self.db.execute(
+                "CREATE TABLE versions (module TEXT, position INTEGER, version TEXT, yanked INTEGER, "
+                "PRIMARY KEY (module, position))"
+            )
+            self.db.execute(
+                "CREATE TABLE fields (module TEXT, field TEXT, gram_count INTEGER, PRIMARY KEY (module, field))"
+            )
+            self.db.execute(
+                "CREATE TABLE trigrams (gram TEXT, field TEXT, module TEXT, PRIMARY KEY (gram, field, module)) "
+                "WITHOUT ROWID"
+            )
+            # Re-indexing a module deletes its grams; without this every delete scans the whole table.
+            self.db.execute("CREATE INDEX trigrams_by_module ON trigrams (module, field)")
+            self.db.execute(
+                "CREATE TABLE module_files (module TEXT, version TEXT, mtime_ns INTEGER, size INTEGER, "
+                "PRIMARY KEY (module, version))"
+            )
+            self.db.execute(
+                "CREATE TABLE deps (dep TEXT, dep_version TEXT, module TEXT, version TEXT, dev INTEGER, "
+                "PRIMARY KEY (dep, dep_version, module, version)) WITHOUT ROWID"
+            )
+            self.db.execute("CREATE INDEX deps_by_dependent ON deps (module, version)")
+            self.db.execute("INSERT INTO state VALUES ('schema', ?)", (str(self.SCHEMA),))
+
+    def refresh(self, force: bool = False) -> None:
+        rows = self.db.execute("SELECT name, metadata_mtime_ns, metadata_size FROM modules")
+        indexed = {name: (mtime, size) for name, mtime, size in rows}
+        present = set()
+        with self.db:
+            for entry in os.scandir(self.modules_dir):
+                if not entry.is_dir():
+                    continue
+                present.add(entry.name)
+                metadata_path = pathlib.Path(entry.path) / "metadata.json"
+                try:
+                    stat = metadata_path.stat()
+                    stamp = (stat.st_mtime_ns, stat.st_size)
+                except OSError:
+                    stamp = (-1, -1)
+                if force or indexed.get(entry.name) != stamp:
+                    self._index_module(entry.name, metadata_path, stamp, replace=entry.name in indexed)
+            for name in indexed.keys() - present:
+                self._delete_module(name)
+
+    def refresh_deps(self, force: bool = False) -> None:
+        indexed = {module for (module,) in self.db.execute("SELECT DISTINCT module FROM module_files")}
+        present = set()
+        with self.db:
+            for entry in os.scandir(self.modules_dir):
+                if not entry.is_dir():
+                    continue
+                present.add(entry.name)
+                self._index_module_files(entry.name, pathlib.Path(entry.path), force)
+            for name in indexed - present:
+                self._delete_module(name)
+
+    def _index_module_files(self, name: str, module_dir: pathlib.Path, force: bool = False) -> None:
+        """Re-parse the MODULE.bazel files of `name` whose size or mtime changed."""
+        indexed = {
+            version: (mtime, size)
+            for version, mtime, size in self.db.execute(
+                "SELECT version, mtime_ns, size FROM module_files WHERE module = ?", (name,)
+            )
+        }
+        present = set()
+        for entry in os.scandir(module_dir):
+            module_file = pathlib.Path(entry.path) / "MODULE.bazel"
+            try:
+                stat = module_file.stat()
+            except OSError:
+                continue
+            version = entry.name
+            present.add(version)
+            if not force and indexed.get(version) == (stat.st_mtime_ns, stat.st_size):
+                continue
+            try:
+                deps = _parse_deps_from_text(module_file.read_text(encoding="utf-8"), module_file)
+            except (OSError, UnicodeDecodeError):
+                deps = []
+            self.db.execute("DELETE FROM deps WHERE module = ? AND version = ?", (name, version))
+            self.db.executemany(
+                "INSERT OR REPLACE INTO deps VALUES (?, ?, ?, ?, ?)",
+                [(dep.name, dep.version or "", name, version, dep.dev_dependency) for dep in deps],
+            )
+            self.db.execute(
+                "INSERT OR REPLACE INTO module_files VALUES (?, ?, ?, ?)", (name, version, stat.st_mtime_ns, stat.st_size)
+            )
+        for version in indexed.keys() - present:
+            self.db.execute("DELETE FROM deps WHERE module = ? AND version = ?", (name, version))
+            self.db.execute("DELETE FROM module_files WHERE module = ? AND version = ?", (name, version))
+
+    def _delete_module(self, name: str, metadata_only: bool = False) -> None:
+        tables = [("modules", "name"), ("versions", "module"), ("fields", "module"), ("trigrams", "module")]
+        if not metadata_only:
+            tables += [("module_files", "module"), ("deps", "module")]
+        for table, column in tables:
+            self.db.execute(f"DELETE FROM {table} WHERE {column} = ?", (name,))
+
+    def _index_module(self, name: str, metadata_path: pathlib.Path, stamp: Tuple[int, int], replace: bool) -> None:
+        try:
+            metadata = json.loads(metadata_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            metadata = {}
+        yanked = metadata.get("yanked_versions") or {}
+        maintainers = " ".join(
+            str(value)
+            for maintainer in metadata.get("maintainers") or []
+            for key, value in maintainer.items()
+            if key in ("name", "github", "email")
+        )
+        if replace:
+            self._delete_module(name, metadata_only=True)
+        self.db.execute(
+            "INSERT INTO modules VALUES (?, ?, ?, ?, ?)",
+            (name, metadata.get("homepage"), maintainers, *stamp),
+        )
+        self.db.executemany(
+            "INSERT INTO versions VALUES (?, ?, ?, ?)",
+            [(name, i, version, version in yanked) for i, version in enumerate(metadata.get("versions", []))],
+        )
+        for field_name, text in (("name", name), ("homepage", metadata.get("homepage") or ""), ("maintainers", maintainers)):
+            grams = _trigrams(text)
+            self.db.execute("INSERT INTO fields VALUES (?, ?, ?)", (name, field_name, len(grams)))
+            self.db.executemany("INSERT INTO trigrams VALUES (?, ?, ?)", [(gram, field_name, name) for gram in grams])
+
+    def find(self, query: str) -> List[str]:
+        rows = self.db.execute(
+            "SELECT name FROM modules WHERE instr(lower(name), ?) > 0 ORDER BY name",
+            (query.lower(),),
+        )
+        return [name for (name,) in rows]
+
+    def fuzzy_find(self, query: str, fields: Sequence[str] = ("name",), limit: int = 20) -> List[Tuple[str, float]]:
+        """Rank modules by trigram similarity of `query` to any of `fields`.
+
+        The score of a field is the Jaccard similarity of the two trigram sets;
+        a module scores by its best field, with non-name fields weighted down.
+        """
+        grams = _trigrams(query)
+        if not grams:
+            return []
+        gram_marks = ",".join("?" * len(grams))
+        field_marks = ",".join("?" * len(fields))
+        rows = self.db.execute(
+            f"""
+            SELECT t.module, t.field, COUNT(*), f.gram_count
+            FROM trigrams t JOIN fields f ON f.module = t.module AND f.field = t.field
+            WHERE t.gram IN ({gram_marks}) AND t.field IN ({field_marks})
+            GROUP BY t.module, t.field
+            """,
+            [*grams, *fields],
+        )
+        scores: Dict[str, float] = {}
+        for module, field_name, shared, gram_count in rows:
+            score = shared / (len(grams) + gram_count - shared)
+            score *= 1.0 if field_name == "name" else FUZZY_FIELD_WEIGHT
+            if score > scores.get(module, 0.0):
+                scores[module] = score
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [(module, score) for module, score in ranked if score >= FUZZY_MIN_SCORE][:limit]
+
+    def rdeps(self, dep: str, dep_version: Optional[str] = None) -> List[Tuple[str, str, str, bool]]:
+        """(module, version, dep version, dev) for every module version with a `bazel_dep` on `dep`."""
+        if dep_version is None:
+            rows = self.db.execute("SELECT module, version, dep_version, dev FROM deps WHERE dep = ?", (dep,))
+        else:
+            rows = self.db.execute(
+                "SELECT module, version, dep_version, dev FROM deps WHERE dep = ? AND dep_version = ?", (dep, dep_version)
+            )
+        result = [(module, version, used, bool(dev)) for module, version, used, dev in rows]
+        result.sort(key=lambda row: (row[0], version_key(row[1])))
+        return result
+
+    def versions(self, module: str) -> Optional[List[Tuple[str, bool]]]:
+        if not self.db.execute("SELECT 1 FROM modules WHERE name = ?", (module,)).fetchone():
+            return None
+        rows = self.db.execute("SELECT version, yanked FROM versions WHERE module = ? ORDER BY position", (module,))
+        return [(version, bool(yanked)) for version, yanked in rows]
+
+
+def _registry_index(args: argparse.Namespace) -> RegistryIndex:
+    index = RegistryIndex(args.registry_path)
+    index.refresh(force=args.refresh_index)
+    return index
 
 
-def _scan_module_files(files: Sequence[pathlib.Path]) -> Tuple[List[Dep], List[Dep], List[Dep]]:
+def _scan_module_files(files: Dict[pathlib.Path, ModuleFile]) -> Tuple[List[Dep], List[Dep], List[Dep]]:
     deps: List[Dep] = []
     overrides: List[Dep] = []
     archive_overrides: List[Dep] = []
-    for path in files:
-        text = _load_text(path)
-        deps.extend(_parse_deps_from_text(text, path))
-        overrides.extend(_parse_overrides_from_text(text, path))
-        archive_overrides.extend(_parse_archive_overrides_from_text(text, path))
+    for path, module_file in files.items():
+        calls = module_file.calls
+        deps.extend(_calls_to_deps(calls, path, "bazel_dep", "name"))
+        overrides.extend(_calls_to_deps(calls, path, "single_version_override", "module_name"))
+        archive_overrides.extend(_calls_to_deps(calls, path, "archive_override", "module_name"))
     return deps, overrides, archive_overrides
 
 
@@ -257,39 +1544,71 @@ def _format_effective_location(dep: Dep, source: Optional[Dep] = None) -> str:
     return f"dep {_format_location(dep)}; override {_format_location(source)}"
 
 
-def _update_text(
-    text: str,
-    updates: Dict[str, str],
-    call_name: str,
-    key_name: str,
-) -> Tuple[str, List[Update]]:
-    if not updates:
-        return text, []
+@dataclass
+class Edit:
+    start: int
+    end: int
+    text: str
+
 
+def _plan_version_edits(
+    module_file: ModuleFile,
+    updates: Dict[str, str],
+    call_keys: Dict[str, str],
+) -> Tuple[List[Edit], List[Update]]:
+    """Plan version bumps for every call in `call_keys` (call name -> name kwarg).
+
+    Each edit replaces just the `version = "..."` literal of one call, so
+    edits never overlap and can be applied together by `_apply_edits`.
+    """
+    edits: List[Edit] = []
     changes: List[Update] = []
-    blocks = list(_extract_calls(text, call_name))
-    for start, end, block in reversed(blocks):
-        name = _find_kwarg_string(block, key_name)
-        if not name or name not in updates:
+    for call in module_file.calls:
+        if call.name not in call_keys:
+            continue
+        name = call.kwargs.get(call_keys[call.name])
+        if not isinstance(name, str) or name not in updates:
             continue
-        old_version = _find_kwarg_string(block, "version")
-        if not old_version:
+        span = call.spans.get("version")
+        if span is None:
             continue
+        old_version = module_file.text[span[0] : span[1]]
         new_version = updates[name]
         if old_version == new_version:
             continue
-        new_block = _replace_version(block, new_version)
-        text = text[:start] + new_block + text[end:]
+        edits.append(Edit(start=span[0], end=span[1], text=new_version))
         changes.append(
-            Update(
-                name=name,
-                old_version=old_version,
-                new_version=new_version,
-                file=pathlib.Path(""),
-                call=call_name,
-            )
+            Update(name=name, old_version=old_version, new_version=new_version, file=module_file.path, call=call.name)
         )
-    return text, changes
+    return edits, changes
+
+
+def _apply_edits(text: str, edits: Sequence[Edit]) -> str:
+    """Splice non-overlapping `edits` into `text` in one linear pass."""
+    parts: List[str] = []
+    pos = 0
+    for edit in sorted(edits, key=lambda e: e.start):
+        if edit.start < pos:
+            raise ValueError(f"Overlapping edits at offset {edit.start}")
+        parts.append(text[pos : edit.start])
+        parts.append(edit.text)
+        pos = edit.end
+    parts.append(text[pos:])
+    return "".join(parts)
+
+
+def _plan_upgrades(
+    files: Dict[pathlib.Path, ModuleFile],
+    updates: Dict[str, str],
+    call_keys: Dict[str, str],
+) -> Dict[pathlib.Path, Tuple[str, List[Update]]]:
+    """Plan and apply version bumps per file. Unchanged files are omitted."""
+    planned = {}
+    for path, module_file in files.items():
+        edits, changes = _plan_version_edits(module_file, updates, call_keys)
+        if changes:
+            planned[path] = (_apply_edits(module_file.text, edits) if edits else module_file.text), changes
+    return planned
 
 
 def _diff(old: str, new: str, path: pathlib.Path) -> str:
@@ -304,46 +1623,310 @@ def _diff(old: str, new: str, path: pathlib.Path) -> str:
 
 
 def cmd_find(args: argparse.Namespace) -> None:
-    modules_dir = _local_registry_modules_dir(args.registry_path)
-    query = args.query.lower()
-    matches = [path.name for path in modules_dir.iterdir() if path.is_dir() and query in path.name.lower()]
-    for name in sorted(matches):
-        print(name)
+    index = _registry_index(args)
+    if not args.fuzzy:
+        for name in index.find(args.query):
+            print(name)
+        return
+    fields = args.field or ["name"]
+    for name, score in index.fuzzy_find(args.query, fields, args.limit):
+        print(f"{name} {score:.2f}")
 
 
 def cmd_list_versions(args: argparse.Namespace) -> None:
-    metadata = _local_metadata(args.registry_path, args.module)
-    yanked = set((metadata.get("yanked_versions") or {}).keys())
-    versions = metadata.get("versions", [])
-    for version in versions:
-        if args.include_yanked or version not in yanked:
+    versions = _registry_index(args).versions(args.module)
+    if versions is None:
+        raise SystemExit(f"Module not found in local registry: {args.module}")
+    for version, yanked in versions:
+        if args.include_yanked or not yanked:
             print(version)
 
 
-def _load_module_files(args: argparse.Namespace) -> List[pathlib.Path]:
+def cmd_rdeps(args: argparse.Namespace) -> None:
+    index = RegistryIndex(args.registry_path)
+    index.refresh_deps(force=args.refresh_index)
+    rows = index.rdeps(args.module, args.version)
+    if not rows:
+        target = f"{args.module}@{args.version}" if args.version else args.module
+        print(f"No module versions depend on {target}", file=sys.stderr)
+    for module, version, dep_version, dev in rows:
+        suffix = ", dev_dependency" if dev else ""
+        print(f"{module} {version}  # bazel_dep {args.module} {dep_version or '(no version)'}{suffix}")
+
+
+def _changed_module_versions(registry_path: pathlib.Path, ref: str) -> Set[Tuple[str, str]]:
+    """(module, version) pairs whose version directory differs from `ref` or has untracked files."""
+    commands = [
+        ["git", "-C", str(registry_path), "diff", "--name-only", ref, "--", "modules"],
+        ["git", "-C", str(registry_path), "ls-files", "--others", "--exclude-standard", "--", "modules"],
+    ]
+    changed: Set[Tuple[str, str]] = set()
+    for command in commands:
+        try:
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        except (OSError, subprocess.CalledProcessError) as err:
+            detail = getattr(err, "stderr", "") or str(err)
+            raise SystemExit(f"git failed for --changed-since {ref}: {detail.strip()}")
+        for line in output.splitlines():
+            parts = line.split("/")
+            if len(parts) > 3 and parts[0] == "modules":
+                changed.add((parts[1], parts[2]))
+    return changed
+
+
+def _git_cat_blobs(repo: pathlib.Path, objects: Sequence[str]) -> List[Optional[bytes]]:
+    """Contents of `objects` read in one `git cat-file --batch` run; None for missing or non-blob objects."""
+    if not objects:
+        return []
+    try:
+        output = subprocess.run(
+            ["git", "-C", str(repo), "cat-file", "--batch"],
+            input="".join(f"{name}\n" for name in objects).encode("utf-8"),
+            check=True,
+            capture_output=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError) as err:
+        detail = getattr(err, "stderr", b"") or str(err).encode("utf-8")
+        raise SystemExit(f"git cat-file failed in {repo}: {detail.decode('utf-8', 'replace').strip()}") from None
+    blobs: List[Optional[bytes]] = []
+    pos = 0
+    for _ in objects:
+        end = output.index(b"\n", pos)
+        fields = output[pos:end].split()
+        pos = end + 1
+        if len(fields) != 3:  # "<object> missing" or "ambiguous"
+            blobs.append(None)
+            continue
+        size = int(fields[2])
+        blobs.append(output[pos : pos + size] if fields[1] == b"blob" else None)
+        pos += size + 1
+    return blobs
+
+
+def _metadata_changes(name: str, old: Optional[Dict[str, object]], new: Dict[str, object]) -> List[Dict[str, object]]:
+    versions = [str(version) for version in new.get("versions") or []]  # type: ignore[union-attr]
+    yanked: Dict[str, object] = new.get("yanked_versions") or {}  # type: ignore[assignment]
+    events: List[Dict[str, object]] = []
+    if old is None:
+        events.append({"type": "new_module", "module": name, "versions": versions})
+        old_versions: Set[str] = set()
+        old_yanked: Dict[str, object] = {}
+    else:
+        old_versions = {str(version) for version in old.get("versions") or []}  # type: ignore[union-attr]
+        old_yanked = old.get("yanked_versions") or {}  # type: ignore[assignment]
+    for version in versions:
+        if version not in old_versions:
+            events.append({"type": "added_version", "module": name, "version": version})
+    for version, reason in yanked.items():
+        if version not in old_yanked:
+            events.append({"type": "yanked_version", "module": name, "version": version, "reason": reason})
+    return events
+
+
+def cmd_changes(args: argparse.Namespace) -> None:
+    repo = pathlib.Path(args.registry_path)
+    old_commit = _git_commit(repo, args.from_rev)
+    new_commit = _git_commit(repo, args.to_rev)
+    # diff-tree skips every subtree whose hash is unchanged, so only the changed modules are visited.
+    output = _git(repo, "diff-tree", "-r", "-z", "--no-renames", old_commit, new_commit, "--", "modules")
+    fields = output.split("\0")
+    changed: List[Tuple[str, str, str]] = []
+    for header, path in zip(fields[0::2], fields[1::2]):
+        parts = path.split("/")
+        if len(parts) != 3 or parts[2] != "metadata.json":
+            continue
+        _, _, old_blob, new_blob, status = header.split(" ")
+        if status != "D":
+            changed.append((parts[1], old_blob, new_blob))
+    null_blob = "0" * len(old_commit)
+    old_blobs = [old for _, old, _ in changed if old != null_blob]
+    blobs = dict(zip(old_blobs, _git_cat_blobs(repo, old_blobs)))
+    blobs.update(zip([new for _, _, new in changed], _git_cat_blobs(repo, [new for _, _, new in changed])))
+    for name, old_blob, new_blob in sorted(changed):
+        try:
+            old = json.loads(blobs[old_blob] or b"") if old_blob != null_blob else None
+            new = json.loads(blobs[new_blob] or b"")
+        except ValueError:
+            print(f"warning: skipping {name}: metadata.json is not valid JSON", file=sys.stderr)
+            continue
+        for event in _metadata_changes(name, old, new):
+            print(json.dumps(event))
+
+
+def _verify_module_version(registry_path: str, module: str, version: str, check_archive: bool) -> List[Dict[str, object]]:
+    import registry  # Needs PyYAML; only the verify workers load it.
+
+    archive_cache = registry.ArchiveCache() if check_archive else None
+    client = registry.RegistryClient(registry_path, archive_cache=archive_cache)
+    try:
+        # registry.log() prints to stdout, which is reserved for the JSON report.
+        with contextlib.redirect_stdout(sys.stderr):
+            return client.verify_integrity(module, version, check_archive=check_archive)
+    except (OSError, ValueError, urllib.error.URLError) as err:
+        return [{"module": module, "version": version, "file": None, "error": str(err)}]
+
+
+def cmd_verify(args: argparse.Namespace) -> None:
+    import registry  # Needs PyYAML; imported here so the other commands work without it.
+
+    registry_path = _local_registry_modules_dir(args.registry_path).parent
+    client = registry.RegistryClient(registry_path)
+    module_versions = sorted(client.get_all_module_versions())
+    if args.module:
+        module_versions = [(module, version) for module, version in module_versions if module in args.module]
+    if args.changed_since:
+        changed = _changed_module_versions(registry_path, args.changed_since)
+        module_versions = [key for key in module_versions if key in changed]
+    module_versions = [
+        (module, version)
+        for module, version in module_versions
+        if client.get_source_json_path(module, version).is_file()
+    ]
+
+    mismatches: List[Dict[str, object]] = []
+    if module_versions:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            results = pool.map(
+                _verify_module_version,
+                *zip(*[(str(registry_path), module, version, args.check_archive) for module, version in module_versions]),
+                chunksize=max(1, len(module_versions) // (args.jobs * 4)),
+            )
+            for result in results:
+                mismatches.extend(result)
+    print(json.dumps({"checked": len(module_versions), "mismatches": mismatches}, indent=2))
+    if mismatches:
+        raise SystemExit(1)
+
+
+def _match_module_versions(
+    patterns: Sequence[str], module_versions: Sequence[Tuple[str, str]]
+) -> List[Tuple[str, str]]:
+    """Expand `module@version` patterns (fnmatch globs allowed on both sides) in registry order."""
+    selected: Dict[Tuple[str, str], None] = {}
+    for pattern in patterns:
+        module_pattern, sep, version_pattern = pattern.rpartition("@")
+        if not sep or not module_pattern or not version_pattern:
+            raise SystemExit(f"Expected MODULE@VERSION, got: {pattern}")
+        matches = [
+            key
+            for key in module_versions
+            if fnmatch.fnmatchcase(key[0], module_pattern) and fnmatch.fnmatchcase(key[1], version_pattern)
+        ]
+        if not matches:
+            raise SystemExit(f"No module versions in the registry match {pattern}")
+        selected.update(dict.fromkeys(matches))
+    return list(selected)
+
+
+def _read_checkpoint(path: pathlib.Path) -> Set[Tuple[str, str]]:
+    done: Set[Tuple[str, str]] = set()
+    if not path.exists():
+        return done
+    for line in path.read_text(encoding="utf-8").splitlines():
+        try:
+            entry = json.loads(line)
+            done.add((entry["module"], entry["version"]))
+        except (ValueError, KeyError, TypeError):
+            continue  # A line cut short by an interrupted run.
+    return done
+
+
+def cmd_update_integrity(args: argparse.Namespace) -> None:
+    import registry  # Needs PyYAML; imported here so the other commands work without it.
+
+    registry_path = _local_registry_modules_dir(args.registry_path).parent
+    client = registry.RegistryClient(registry_path, archive_cache=registry.ArchiveCache())
+    patterns = list(args.pairs)
+    if args.from_file:
+        lines = pathlib.Path(args.from_file).read_text(encoding="utf-8").splitlines()
+        patterns.extend(line.strip() for line in lines if line.strip() and not line.lstrip().startswith("#"))
+    if not patterns:
+        raise SystemExit("Pass MODULE@VERSION patterns or --from-file")
+    todo = _match_module_versions(patterns, sorted(client.get_all_module_versions()))
+
+    checkpoint = pathlib.Path(args.checkpoint)
+    done = _read_checkpoint(checkpoint)
+    pending = [key for key in todo if key not in done]
+    skipped = len(todo) - len(pending)
+
+    host_limits: Dict[str, threading.Semaphore] = {}
+    lock = threading.Lock()
+    totals = {"updated": 0, "bytes": 0}
+    failures: List[str] = []
+
+    url_locks: Dict[str, threading.Lock] = {}
+    refreshed: Set[str] = set()
+
+    def update(module: str, version: str) -> None:
+        url = client.get_source(module, version).get("url", "")
+        with lock:
+            limit = host_limits.setdefault(urllib.parse.urlsplit(url).netloc, threading.Semaphore(args.per_host))
+            url_lock = url_locks.setdefault(url, threading.Lock())
+        with url_lock, limit:
+            # The archive may have been re-rolled upstream, so the cached copy is
+            # only trusted once this batch has downloaded it.
+            download = url not in refreshed
+            client.update_integrity(module, version, refresh=download)
+            refreshed.add(url)
+        source = client.get_source(module, version)
+        blob = client.archive_cache.lookup_integrity(source["integrity"]) if download else None
+        size = blob.stat().st_size if blob else 0
+        with lock:
+            totals["updated"] += 1
+            totals["bytes"] += size
+            with checkpoint.open("a", encoding="utf-8") as out:
+                out.write(json.dumps({"module": module, "version": version, "integrity": source["integrity"]}) + "\n")
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        futures = {pool.submit(update, module, version): (module, version) for module, version in pending}
+        for future in futures:
+            module, version = futures[future]
+            try:
+                future.result()
+            except (OSError, ValueError, KeyError, urllib.error.URLError, registry.RegistryException) as err:
+                failures.append(f"{module}@{version}")
+                print(f"error: {module}@{version}: {err}", file=sys.stderr)
+    seconds = time.monotonic() - start
+
+    megabytes = totals["bytes"] / 1e6
+    seconds = max(seconds, 1e-6)
+    print(
+        f"Updated {totals['updated']} of {len(todo)} module versions "
+        f"({skipped} already done, {len(failures)} failed): {megabytes:.1f} MB in {seconds:.1f}s "
+        f"({megabytes / seconds:.1f} MB/s, {totals['updated'] / seconds:.1f} versions/s)"
+    )
+    if failures:
+        print(f"Checkpoint kept at {checkpoint}; re-run the same command to retry the failed versions.", file=sys.stderr)
+        raise SystemExit(1)
+    checkpoint.unlink(missing_ok=True)
+
+
+def _load_module_files(args: argparse.Namespace) -> Dict[pathlib.Path, ModuleFile]:
     root_module = pathlib.Path(args.module_file).resolve()
     workspace_root = pathlib.Path(args.workspace_root).resolve() if args.workspace_root else root_module.parent
-    files = _collect_module_files(root_module, workspace_root)
-    return sorted(files)
+    cache = None if args.no_file_cache else _module_file_cache()
+    files = _collect_module_files(root_module, workspace_root, cache)
+    return {path: files[path] for path in sorted(files)}
 
 
 def cmd_list_deps(args: argparse.Namespace) -> None:
-    files = _load_module_files(args)
-    deps, _, _ = _scan_module_files(files)
+    deps, _, _ = _scan_module_files(_load_module_files(args))
     for dep in sorted(deps, key=lambda d: (d.name, str(d.file), d.line)):
         version = dep.version or "(no version)"
         print(f"{dep.name} {version}  # {_format_location(dep)}")
 
 
 def cmd_deps_tree(args: argparse.Namespace) -> None:
-    files = _load_module_files(args)
-    deps, _, _ = _scan_module_files(files)
+    deps, _, _ = _scan_module_files(_load_module_files(args))
 
     roots: Dict[str, Optional[str]] = {}
     for dep in deps:
         if dep.name not in roots or (roots[dep.name] is None and dep.version):
             roots[dep.name] = dep.version
 
+    store = _module_store()
+    infos = _expand_frontier(roots.items(), args.max_depth, args.registry_url, _fetcher_from_args(args), store)
     visited: Dict[Tuple[str, str], None] = {}
 
     def walk(name: str, version: Optional[str], depth: int) -> List[str]:
@@ -357,19 +1940,130 @@ def cmd_deps_tree(args: argparse.Namespace) -> None:
             lines[-1] += " (visited)"
             return lines
         visited[key] = None
-        module_url = f"{args.registry_url.rstrip('/')}/{name}/{version}/MODULE.bazel"
-        try:
-            text = _download_text_url(module_url)
-        except Exception:
+        info = infos.get(key)
+        if info is None:
             return lines
-        child_deps = _parse_deps_from_text(text, pathlib.Path(module_url))
-        for child in sorted(child_deps, key=lambda d: d.name):
+        for child in sorted(info.deps, key=lambda d: d.name):
             lines.extend(walk(child.name, child.version, depth + 1))
         return lines
 
     for name, version in sorted(roots.items()):
         for line in walk(name, version, 0):
             print(line)
+    if args.stats:
+        print(f"module store: {store.hits} hits, {store.misses} misses", file=sys.stderr)
+
+
+@dataclass
+class Resolution:
+    selected: Dict[str, Tuple[str, int]]
+    overridden: Dict[str, str]
+    missing: List[str]
+    errors: List[str]
+
+
+def _resolve(
+    root_deps: Sequence[Dep],
+    overrides: Sequence[Dep],
+    archive_overrides: Sequence[Dep],
+    registry_url: str,
+    fetcher: RegistryBackend,
+    store: ModuleStore,
+) -> Resolution:
+    """Run Bzlmod-style minimal version selection over the registry graph.
+
+    Every version reachable from the root is loaded, the highest requested
+    version is selected per (module, compatibility level), and the final graph
+    is the part reachable from the root under that selection.
+    `single_version_override` pins replace every request for their module;
+    `archive_override` modules are outside the registry and not expanded.
+    """
+    pinned = {dep.name: dep.version for dep in overrides if dep.version}
+    non_registry = {dep.name: dep.call for dep in archive_overrides}
+
+    def request(dep: Dep) -> Optional[Tuple[str, str]]:
+        if dep.name in non_registry:
+            return None
+        version = pinned.get(dep.name, dep.version)
+        return (dep.name, version) if version else None
+
+    def edges(info: ModuleInfo) -> List[Tuple[str, str]]:
+        return [key for dep in info.deps if not dep.dev_dependency for key in [request(dep)] if key]
+
+    errors: List[str] = []
+    roots: List[Tuple[str, str]] = []
+    for dep in root_deps:
+        key = request(dep)
+        if key:
+            roots.append(key)
+        elif dep.name not in non_registry:
+            errors.append(f"{dep.name} has no version and no override  # {_format_location(dep)}")
+
+    infos = _expand_frontier(roots, None, registry_url, fetcher, store, edges)
+
+    def level(key: Tuple[str, str]) -> int:
+        info = infos.get(key)
+        return info.compatibility_level if info else 0
+
+    try:
+        best: Dict[Tuple[str, int], str] = {}
+        for key in infos:
+            group = (key[0], level(key))
+            if group not in best or version_key(key[1]) > version_key(best[group]):
+                best[group] = key[1]
+    except ValueError as err:
+        raise SystemExit(str(err)) from err
+
+    selected: Dict[Tuple[str, str], None] = {}
+    queue = deque((name, best[(name, level((name, version)))]) for name, version in roots)
+    while queue:
+        key = queue.popleft()
+        if key in selected:
+            continue
+        selected[key] = None
+        info = infos.get(key)
+        if info:
+            queue.extend((name, best[(name, level((name, version)))]) for name, version in edges(info))
+
+    by_name: Dict[str, List[str]] = {}
+    for name, version in selected:
+        by_name.setdefault(name, []).append(version)
+    result: Dict[str, Tuple[str, int]] = {}
+    for name, versions in sorted(by_name.items()):
+        versions.sort(key=version_key)
+        if len(versions) > 1:
+            listed = ", ".join(f"{v} (compatibility_level {level((name, v))})" for v in versions)
+            errors.append(f"{name} is required at incompatible versions: {listed}")
+        result[name] = (versions[-1], level((name, versions[-1])))
+
+    return Resolution(
+        selected=result,
+        overridden=non_registry,
+        missing=sorted(f"{name}@{version}" for name, version in selected if infos.get((name, version)) is None),
+        errors=errors,
+    )
+
+
+def cmd_resolve(args: argparse.Namespace) -> None:
+    deps, overrides, archive_overrides = _scan_module_files(_load_module_files(args))
+    resolution = _resolve(deps, overrides, archive_overrides, args.registry_url, _fetcher_from_args(args), _module_store())
+    modules: Dict[str, Dict[str, object]] = {
+        name: {"version": version, "compatibility_level": level} for name, (version, level) in resolution.selected.items()
+    }
+    for name, call in resolution.overridden.items():
+        modules[name] = {"version": "", "override": call}
+    result = {
+        "root": sorted({dep.name for dep in deps}),
+        "modules": modules,
+        "missing": resolution.missing,
+        "errors": resolution.errors,
+    }
+    print(json.dumps(result, indent=2, sort_keys=True))
+
+
+def cmd_prune_store(args: argparse.Namespace) -> None:
+    removed, removed_bytes = _module_store().prune(0 if args.all else args.older_than_days)
+    print(f"Removed {removed} module store entries ({removed_bytes / 1024:.1f} KiB)")
 
 
 def cmd_upgrade(args: argparse.Namespace) -> None:
@@ -387,35 +2081,109 @@ def cmd_upgrade(args: argparse.Namespace) -> None:
     latest = _latest_versions(
         sorted(selected),
         args.registry_url,
+        fetcher=_fetcher_from_args(args),
         include_prerelease=args.include_prerelease,
         include_yanked=args.include_yanked,
     )
 
-    for path in files:
-        text = _load_text(path)
-        new_text = text
-        changes: List[Update] = []
-        new_text, dep_changes = _update_text(new_text, latest, "bazel_dep", "name")
-        changes.extend(dep_changes)
-        if args.include_overrides:
-            new_text, override_changes = _update_text(new_text, latest, "single_version_override", "module_name")
-            changes.extend(override_changes)
-
-        if not changes:
-            continue
-
-        if args.write:
-            _write_text(path, new_text)
-        else:
-            diff = _diff(text, new_text, path)
+    call_keys = {"bazel_dep": "name"}
+    if args.include_overrides:
+        call_keys["single_version_override"] = "module_name"
+    planned = _plan_upgrades(files, latest, call_keys)
+
+    if args.write:
+        _write_texts_atomically({path: new_text for path, (new_text, _) in planned.items()})
+        return
+    for path, (new_text, _) in planned.items():
+        diff = _diff(files[path].text, new_text, path)
+        if diff:
+            print(diff, end="")
+
+
+class _FetcherSession:
+    """Gives registry.py's download helpers a `RegistryBackend`, so they share its cache or local source."""
+
+    def __init__(self, fetcher: RegistryBackend) -> None:
+        self.fetcher = fetcher
+
+    def get(self, url: str) -> bytes:
+        return self.fetcher.get(url)
+
+
+def _diff_mappings(old: Dict[str, object], new: Dict[str, object]) -> Dict[str, object]:
+    diff: Dict[str, object] = {}
+    added = {key: new[key] for key in new.keys() - old.keys()}
+    removed = {key: old[key] for key in old.keys() - new.keys()}
+    changed = {key: [old[key], new[key]] for key in old.keys() & new.keys() if old[key] != new[key]}
+    for name, values in (("added", added), ("removed", removed), ("changed", changed)):
+        if values:
+            diff[name] = values
+    return diff
+
+
+def _presubmit_matrix(doc: object, path: str = "") -> Dict[str, object]:
+    """Flatten the `matrix` entries and task `platform`/`bazel` settings of a presubmit.yml."""
+    entries: Dict[str, object] = {}
+    if isinstance(doc, dict):
+        for key, value in doc.items():
+            entries.update(_presubmit_matrix(value, f"{path}.{key}" if path else str(key)))
+    elif isinstance(doc, list) and any(isinstance(item, (dict, list)) for item in doc):
+        for i, item in enumerate(doc):
+            entries.update(_presubmit_matrix(item, f"{path}[{i}]"))
+    elif "matrix" in path.split(".") or path.rsplit(".", 1)[-1] in ("platform", "bazel"):
+        entries[path] = doc
+    return entries
+
+
+def _snapshot_summary(snapshot: object) -> Dict[str, Dict[str, object]]:
+    import yaml  # Needs PyYAML; only loaded by diff-versions.
+
+    module_text = snapshot.module_dot_bazel() or ""  # type: ignore[attr-defined]
+    deps: Dict[str, object] = {}
+    for dep in _parse_deps_from_text(module_text, pathlib.Path("MODULE.bazel")):
+        deps[dep.name] = f"{dep.version or '(no version)'}{' (dev)' if dep.dev_dependency else ''}"
+    presubmit_lines = snapshot.presubmit_yml_lines()  # type: ignore[attr-defined]
+    presubmit = _presubmit_matrix(yaml.safe_load("".join(presubmit_lines))) if presubmit_lines else {}
+    attestations: Dict[str, object] = {}
+    document = snapshot.attestations()  # type: ignore[attr-defined]
+    if document:
+        attestations["mediaType"] = document.get("mediaType")
+        for name, attestation in (document.get("attestations") or {}).items():
+            url = attestation.get("url", "") if isinstance(attestation, dict) else ""
+            attestations[name] = urllib.parse.urlsplit(url).netloc or "(no url)"
+    return {"deps": deps, "presubmit": presubmit, "attestations": attestations}
+
+
+def cmd_diff_versions(args: argparse.Namespace) -> None:
+    import registry  # Needs PyYAML; imported here so the other commands work without it.
+
+    upstream = registry.UpstreamRegistry(args.registry_url, session=_FetcherSession(_fetcher_from_args(args)))
+    snapshots = upstream.get_module_snapshots(
+        args.module,
+        versions=args.version,
+        last=None if args.version else args.last,
+        include_yanked=args.include_yanked,
+        jobs=args.jobs,
+    )
+    if snapshots is None:
+        raise SystemExit(f"Module not found in registry: {args.module}")
+    summaries = [(snapshot.version, _snapshot_summary(snapshot)) for snapshot in snapshots]
+    result = []
+    for (old_version, old), (new_version, new) in zip(summaries, summaries[1:]):
+        entry: Dict[str, object] = {"from": old_version, "to": new_version}
+        for section in ("deps", "presubmit", "attestations"):
+            diff = _diff_mappings(old[section], new[section])
             if diff:
-                print(diff, end="")
+                entry[section] = diff
+        result.append(entry)
+    print(json.dumps(result, indent=2, sort_keys=True))
 
 
 def cmd_latest(args: argparse.Namespace) -> None:
     latest = _latest_versions(
         args.module,
         args.registry_url,
+        fetcher=_fetcher_from_args(args),
         include_prerelease=args.include_prerelease,
         include_yanked=args.include_yanked,
     )
@@ -428,8 +2196,7 @@ def cmd_latest(args: argparse.Namespace) -> None:
 
 
 def cmd_check_upgrades(args: argparse.Namespace) -> None:
-    files = _load_module_files(args)
-    deps, overrides, archive_overrides = _scan_module_files(files)
+    deps, overrides, archive_overrides = _scan_module_files(_load_module_files(args))
 
     selected = set(args.module) if args.module else {dep.name for dep in deps}
     override_by_name = {dep.name: dep for dep in overrides if dep.version}
@@ -446,6 +2213,7 @@ def cmd_check_upgrades(args: argparse.Namespace) -> None:
     latest = _latest_versions(
         sorted(set(effective_names)),
         args.registry_url,
+        fetcher=_fetcher_from_args(args),
         include_prerelease=args.include_prerelease,
         include_yanked=args.include_yanked,
     )
@@ -504,6 +2272,313 @@ def cmd_check_upgrades(args: argparse.Namespace) -> None:
             print(f"{dep.name} {current_version}  # {_format_effective_location(dep, source)}")
 
 
+def _listed_snapshot_files(
+    names: Sequence[str], registry_url: str, fetcher: RegistryBackend, module_files: bool
+) -> Iterable[Tuple[str, bytes]]:
+    """Read the metadata.json (and with `module_files` every MODULE.bazel) of `names`, a chunk at a time."""
+    for start in range(0, len(names), 256):
+        chunk = names[start : start + 256]
+        bodies = fetcher.get_many([_metadata_url(name, registry_url) for name in chunk])
+        metadata: Dict[str, bytes] = {}
+        for name in chunk:
+            body = bodies[_metadata_url(name, registry_url)]
+            if isinstance(body, urllib.error.HTTPError) and body.code == 404:
+                continue
+            if isinstance(body, Exception):
+                raise body
+            metadata[name] = body
+        urls: Dict[str, List[str]] = {}
+        if module_files:
+            for name, body in metadata.items():
+                try:
+                    versions = json.loads(body).get("versions", [])
+                except ValueError:
+                    versions = []
+                urls[name] = [_module_file_url(name, version, registry_url) for version in versions]
+        module_bodies = fetcher.get_many([url for name_urls in urls.values() for url in name_urls], use_cache=False)
+        for name, body in metadata.items():
+            yield f"{name}/metadata.json", body
+            for url in urls.get(name, []):
+                module_body = module_bodies[url]
+                if not isinstance(module_body, Exception):
+                    yield url[len(registry_url.rstrip("/")) + 1 :], module_body
+
+
+def _crawl_snapshot_files(
+    seeds: Iterable[str], registry_url: str, fetcher: RegistryBackend, module_files: bool
+) -> List[Tuple[str, bytes]]:
+    """Fetch metadata.json of `seeds` and of everything they transitively depend on.
+
+    Dependencies are discovered from the MODULE.bazel of every version when
+    `module_files` is set (those files are bundled too), otherwise from the
+    latest version of each module only.
+    """
+    files: List[Tuple[str, bytes]] = []
+    seen: Set[str] = set()
+    frontier = set(seeds)
+    while frontier:
+        names = sorted(frontier - seen)
+        seen.update(names)
+        frontier = set()
+        bodies = fetcher.get_many([_metadata_url(name, registry_url) for name in names])
+        wanted: List[Tuple[str, str]] = []
+        for name in names:
+            body = bodies[_metadata_url(name, registry_url)]
+            if isinstance(body, urllib.error.HTTPError) and body.code == 404:
+                print(f"warning: {name} is not in {registry_url}", file=sys.stderr)
+                continue
+            if isinstance(body, Exception):
+                raise body
+            files.append((f"{name}/metadata.json", body))
+            versions = json.loads(body).get("versions", [])
+            wanted.extend((name, version) for version in (versions if module_files else versions[-1:]))
+        urls = {key: _module_file_url(key[0], key[1], registry_url) for key in wanted}
+        module_bodies = fetcher.get_many(list(urls.values()), use_cache=False)
+        for (name, version), url in urls.items():
+            body = module_bodies[url]
+            if isinstance(body, Exception):
+                continue
+            if module_files:
+                files.append((f"{name}/{version}/MODULE.bazel", body))
+            for dep in _parse_deps_from_text(body.decode("utf-8"), pathlib.Path(url)):
+                frontier.add(dep.name)
+    return files
+
+
+def cmd_snapshot(args: argparse.Namespace) -> None:
+    fetcher = _fetcher_from_args(args)
+    info: Dict[str, object] = {
+        "created": int(time.time()),
+        "module_files": args.module_files,
+        "source": fetcher.namespace(args.registry_url) or str(fetcher),
+    }
+    seeds = set(args.module or [])
+    if args.seed_module_file:
+        root_module = pathlib.Path(args.seed_module_file).resolve()
+        for module_file in _collect_module_files(root_module, root_module.parent).values():
+            seeds.update(dep.name for dep in _calls_to_deps(module_file.calls, module_file.path, "bazel_dep", "name"))
+    files: Iterable[Tuple[str, bytes]]
+    if seeds:
+        files = _crawl_snapshot_files(seeds, args.registry_url, fetcher, args.module_files)
+    else:
+        names = fetcher.list_modules()
+        if names is None:
+            raise SystemExit(
+                "Crawling needs --module or --seed-module-file (or bundle --registry-path or --git-registry whole)"
+            )
+        files = _listed_snapshot_files(names, args.registry_url, fetcher, args.module_files)
+    count, size = SnapshotBundle.write(pathlib.Path(args.output), files, info)
+    print(f"Wrote {count} files to {args.output} ({size / 1e6:.1f} MB)")
+
+
+def _daemon_socket_path() -> pathlib.Path:
+    return pathlib.Path(os.environ.get("BCR_TOOL_SOCKET") or _cache_home() / "daemon.sock")
+
+
+def _code_stamp() -> List[int]:
+    """mtimes of the scripts a daemon has loaded, so clients can detect a stale daemon."""
+    scripts = pathlib.Path(__file__).resolve().parent
+    return [path.stat().st_mtime_ns for path in sorted(scripts.glob("*.py"))]
+
+
+def _daemon_env() -> Dict[str, str]:
+    return {
+        key: value
+        for key, value in os.environ.items()
+        if key in DAEMON_ENV_VARS
+        or key.lower() in DAEMON_ENV_VARS
+        or key.startswith("BCR_") and key not in ("BCR_TOOL_SOCKET", "BCR_TOOL_NO_DAEMON")
+    }
+
+
+def _daemon_can_run(argv: Sequence[str]) -> bool:
+    """Whether `argv` is a valid read-only query; edits, batch jobs, --help and usage errors run in-process."""
+    try:
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            args = _parse_args(argv)
+    except SystemExit:
+        return False
+    return args.command in DAEMON_COMMANDS and not getattr(args, "write", False)
+
+
+def _daemon_request(request: Dict[str, object], socket_path: pathlib.Path) -> Optional[Dict[str, object]]:
+    """Send one request to a running daemon; None if no daemon answers in time.
+
+    The daemon acknowledges a command it starts with an `accepted` line
+    within DAEMON_CONNECT_TIMEOUT, then has DAEMON_RUN_TIMEOUT to send the
+    result line. Any other first line is the whole reply.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(DAEMON_CONNECT_TIMEOUT)
+            sock.connect(str(socket_path))
+            sock.sendall(json.dumps(request).encode("utf-8"))
+            sock.shutdown(socket.SHUT_WR)
+            reader = sock.makefile("rb")
+            reply = json.loads(reader.readline())
+            if isinstance(reply, dict) and reply.get("accepted"):
+                sock.settimeout(DAEMON_RUN_TIMEOUT)
+                reply = json.loads(reader.read())
+    except (OSError, ValueError):
+        return None
+    return reply if isinstance(reply, dict) else None
+
+
+def _run_in_daemon(argv: Sequence[str]) -> Optional[int]:
+    """Run `argv` in a running `serve` daemon and replay its output; None to run in-process."""
+    socket_path = _daemon_socket_path()
+    if os.environ.get("BCR_TOOL_NO_DAEMON") or not socket_path.exists() or not _daemon_can_run(argv):
+        return None
+    request = {"argv": list(argv), "cwd": os.getcwd(), "env": _daemon_env(), "stamp": _code_stamp()}
+    reply = _daemon_request(request, socket_path)
+    if reply is None or "exit" not in reply:
+        return None
+    sys.stdout.write(str(reply.get("stdout", "")))
+    sys.stderr.write(str(reply.get("stderr", "")))
+    return int(reply["exit"])  # type: ignore[call-overload]
+
+
+def _run_captured(argv: Sequence[str], cwd: str) -> Dict[str, object]:
+    stdout, stderr = io.StringIO(), io.StringIO()
+    home = os.getcwd()
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            os.chdir(cwd)
+            code = _run(argv)
+        except SystemExit as err:
+            if err.code is None or isinstance(err.code, int):
+                code = err.code or 0
+            else:
+                print(err.code, file=sys.stderr)
+                code = 1
+        except Exception:
+            traceback.print_exc()
+            code = 1
+        finally:
+            os.chdir(home)
+    return {"stdout": stdout.getvalue(), "stderr": stderr.getvalue(), "exit": code}
+
+
+class _DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Runs bcr_tool requests, keeping fetchers and caches warm between them.
+
+    Commands redirect stdout and change directory, so only one runs at a
+    time; a request arriving meanwhile is answered `busy` at once and its
+    client runs the command itself instead of queueing behind it.
+    """
+
+    daemon_threads = False
+
+    def __init__(self, socket_path: pathlib.Path, idle_timeout: float) -> None:
+        self.stamp = _code_stamp()
+        self.env = _daemon_env()
+        self.stopping = False
+        # Handlers run on their own threads, so wake up regularly to notice `stop` and the idle timeout.
+        self.timeout = 1.0
+        self.idle_timeout = idle_timeout
+        self.last_active = time.monotonic()
+        self.run_lock = threading.Lock()
+        super().__init__(str(socket_path), _DaemonHandler)
+
+    def handle_timeout(self) -> None:
+        if self.run_lock.locked():
+            self.last_active = time.monotonic()
+        elif self.idle_timeout and time.monotonic() - self.last_active > self.idle_timeout:
+            self.stopping = True
+
+
+class _DaemonHandler(socketserver.StreamRequestHandler):
+    server: _DaemonServer
+
+    def _reply(self, reply: Dict[str, object]) -> None:
+        self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+    def handle(self) -> None:
+        self.server.last_active = time.monotonic()
+        try:
+            request = json.loads(self.rfile.read())
+        except ValueError:
+            return
+        if request.get("ping"):
+            self._reply({"pong": True})
+        elif request.get("stop"):
+            self.server.stopping = True
+            self._reply({"stopped": True})
+        elif request.get("stamp") != self.server.stamp:
+            # The scripts changed since the daemon started; let the client run them itself.
+            self.server.stopping = True
+            self._reply({"stale": True})
+        elif request.get("env") != self.server.env:
+            self._reply({"env_mismatch": True})
+        elif not _daemon_can_run(request["argv"]):
+            self._reply({"refused": True})
+        elif not self.server.run_lock.acquire(blocking=False):
+            self._reply({"busy": True})
+        else:
+            try:
+                self._reply({"accepted": True})
+                self._reply(_run_captured(request["argv"], request["cwd"]))
+            finally:
+                self.server.run_lock.release()
+
+
+def cmd_serve(args: argparse.Namespace) -> None:
+    socket_path = pathlib.Path(args.socket) if args.socket else _daemon_socket_path()
+    if args.stop:
+        if _daemon_request({"stop": True}, socket_path) is None:
+            raise SystemExit(f"No bcr_tool daemon is listening on {socket_path}")
+        return
+    if _daemon_request({"ping": True}, socket_path) is not None:
+        raise SystemExit(f"A bcr_tool daemon is already listening on {socket_path}")
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    socket_path.unlink(missing_ok=True)
+    with contextlib.ExitStack() as stack:
+        old_umask = os.umask(0o077)
+        try:
+            server = stack.enter_context(_DaemonServer(socket_path, args.idle_timeout))
+        finally:
+            os.umask(old_umask)
+        stack.callback(socket_path.unlink, missing_ok=True)
+        stack.callback(_close_fetchers)
+        print(f"bcr_tool daemon listening on {socket_path}", file=sys.stderr)
+        while not server.stopping:
+            server.handle_request()
+
+
+def _add_registry_args(parser: argparse.ArgumentParser) -> None:
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--registry-url", default=DEFAULT_REGISTRY_URL, help="Registry to query over HTTP")
+    source.add_argument("--registry-path", help="Read a local registry checkout (its modules/ directory) instead")
+    source.add_argument(
+        "--git-registry", help="Read registry files from this git repository's objects at --git-rev, without a checkout"
+    )
+    source.add_argument(
+        "--snapshot", help="Answer from a bundle built by the snapshot command instead of the network"
+    )
+    parser.add_argument("--git-rev", default="HEAD", help="Revision read with --git-registry")
+
+
+def _add_cache_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=DEFAULT_CACHE_TTL,
+        help="Seconds a cached registry response is used without revalidation",
+    )
+    parser.add_argument("--cache-max-mb", type=int, default=DEFAULT_CACHE_MAX_MB, help="HTTP cache size limit in MiB")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the on-disk HTTP cache")
+    parser.add_argument("--offline", action="store_true", help="Answer only from the HTTP cache; never hit the network")
+
+
+def _add_module_file_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--module-file", required=True, help="Path to root MODULE.bazel or an included module file")
+    parser.add_argument("--workspace-root", help="Workspace root (defaults to MODULE.bazel directory)")
+    parser.add_argument(
+        "--no-file-cache", action="store_true", help="Re-tokenize module files instead of using the parse cache"
+    )
+
+
 def _parse_args(argv: Sequence[str]) -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Bazel Central Registry helper")
     subparsers = parser.add_subparsers(dest="command", required=True)
@@ -511,64 +2586,193 @@ def _parse_args(argv: Sequence[str]) -> argparse.Namespace:
     find = subparsers.add_parser("find", help="Find modules in a local registry clone")
     find.add_argument("--registry-path", required=True, help="Path to bazel-central-registry checkout")
     find.add_argument("--query", required=True, help="Substring to match")
+    find.add_argument("--fuzzy", action="store_true", help="Rank trigram matches instead of substring matching")
+    find.add_argument(
+        "--field",
+        action="append",
+        choices=FUZZY_FIELDS,
+        help="Field to match with --fuzzy (repeatable, default: name)",
+    )
+    find.add_argument("--limit", type=int, default=20, help="Maximum --fuzzy results")
+    find.add_argument("--refresh-index", action="store_true", help="Re-read every module even if its files look unchanged")
     find.set_defaults(func=cmd_find)
 
     list_versions = subparsers.add_parser("list-versions", help="List versions for a module in a local registry clone")
     list_versions.add_argument("--registry-path", required=True, help="Path to bazel-central-registry checkout")
     list_versions.add_argument("--module", required=True, help="Module name")
     list_versions.add_argument("--include-yanked", action="store_true", help="Include yanked versions")
+    list_versions.add_argument(
+        "--refresh-index", action="store_true", help="Re-read every module even if its files look unchanged"
+    )
     list_versions.set_defaults(func=cmd_list_versions)
 
+    rdeps = subparsers.add_parser("rdeps", help="List module versions in a local registry clone that depend on a module")
+    rdeps.add_argument("--registry-path", required=True, help="Path to bazel-central-registry checkout")
+    rdeps.add_argument("--module", required=True, help="Dependency module name")
+    rdeps.add_argument("--version", help="Only dependents pinning this exact version")
+    rdeps.add_argument(
+        "--refresh-index", action="store_true", help="Re-read every module even if its files look unchanged"
+    )
+    rdeps.set_defaults(func=cmd_rdeps)
+
+    changes = subparsers.add_parser(
+        "changes", help="Emit new modules, added versions and newly yanked versions between two registry revisions"
+    )
+    changes.add_argument("--registry-path", required=True, help="Path to a bazel-central-registry git clone")
+    changes.add_argument("--from", dest="from_rev", required=True, help="Older revision")
+    changes.add_argument("--to", dest="to_rev", default="HEAD", help="Newer revision")
+    changes.set_defaults(func=cmd_changes)
+
+    verify = subparsers.add_parser(
+        "verify", help="Check patch and overlay hashes in source.json files of a local registry clone"
+    )
+    verify.add_argument("--registry-path", required=True, help="Path to bazel-central-registry checkout")
+    verify.add_argument("--module", action="append", help="Only verify named module(s)")
+    verify.add_argument(
+        "--changed-since",
+        metavar="GIT_REF",
+        help="Only verify version directories changed since this git ref (including untracked files)",
+    )
+    verify.add_argument("--check-archive", action="store_true", help="Also download source archives and check them")
+    verify.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    verify.set_defaults(func=cmd_verify)
+
+    update_integrity = subparsers.add_parser(
+        "update-integrity",
+        help="Re-download source archives and rewrite source.json hashes for many versions of a local registry clone",
+    )
+    update_integrity.add_argument("--registry-path", required=True, help="Path to bazel-central-registry checkout")
+    update_integrity.add_argument("pairs", nargs="*", metavar="MODULE@VERSION", help="Module version, globs allowed (e.g. 'rules_*@1.*')")
+    update_integrity.add_argument("--from-file", help="File with one MODULE@VERSION pattern per line")
+    update_integrity.add_argument(
+        "--checkpoint",
+        default="update-integrity.checkpoint.jsonl",
+        help="JSON lines file recording finished versions; a re-run skips them (removed once everything succeeded)",
+    )
+    update_integrity.add_argument("--jobs", type=int, default=DEFAULT_JOBS, help="Concurrent downloads")
+    update_integrity.add_argument("--per-host", type=int, default=4, help="Concurrent downloads per archive host")
+    update_integrity.set_defaults(func=cmd_update_integrity)
+
     latest = subparsers.add_parser("latest", help="Fetch latest versions from BCR metadata")
     latest.add_argument("--module", action="append", required=True, help="Module name (repeatable)")
-    latest.add_argument("--registry-url", default=DEFAULT_REGISTRY_URL)
+    _add_registry_args(latest)
     latest.add_argument("--include-prerelease", action="store_true", help="Allow prerelease versions such as rc/beta")
     latest.add_argument("--include-yanked", action="store_true", help="Allow yanked versions")
+    latest.add_argument("--jobs", type=int, default=DEFAULT_JOBS, help="Concurrent registry requests")
+    _add_cache_args(latest)
     latest.set_defaults(func=cmd_latest)
 
+    diff_versions = subparsers.add_parser(
+        "diff-versions",
+        help="Show how deps, presubmit matrices and attestations changed across versions of a BCR module",
+    )
+    diff_versions.add_argument("--module", required=True, help="Module name")
+    diff_versions.add_argument("--last", type=int, default=5, help="Compare the last N versions (0 for all)")
+    diff_versions.add_argument(
+        "--version", action="append", help="Compare these versions in the given order instead (repeatable)"
+    )
+    diff_versions.add_argument("--include-yanked", action="store_true", help="Include yanked versions")
+    _add_registry_args(diff_versions)
+    diff_versions.add_argument("--jobs", type=int, default=DEFAULT_JOBS, help="Concurrent registry requests")
+    _add_cache_args(diff_versions)
+    diff_versions.set_defaults(func=cmd_diff_versions)
+
     list_deps = subparsers.add_parser("list-deps", help="List direct bazel_dep entries from MODULE.bazel")
-    list_deps.add_argument("--module-file", required=True, help="Path to root MODULE.bazel or an included module file")
-    list_deps.add_argument("--workspace-root", help="Workspace root (defaults to MODULE.bazel directory)")
+    _add_module_file_args(list_deps)
     list_deps.set_defaults(func=cmd_list_deps)
 
     deps_tree = subparsers.add_parser("deps-tree", help="Build a best-effort dependency tree")
-    deps_tree.add_argument("--module-file", required=True, help="Path to root MODULE.bazel or an included module file")
-    deps_tree.add_argument("--workspace-root", help="Workspace root (defaults to MODULE.bazel directory)")
-    deps_tree.add_argument("--registry-url", default=DEFAULT_REGISTRY_URL)
+    _add_module_file_args(deps_tree)
+    _add_registry_args(deps_tree)
     deps_tree.add_argument("--max-depth", type=int, default=2, help="Maximum tree depth")
+    deps_tree.add_argument("--jobs", type=int, default=DEFAULT_JOBS, help="Concurrent registry requests")
+    deps_tree.add_argument("--stats", action="store_true", help="Print module store hits and misses to stderr")
+    _add_cache_args(deps_tree)
     deps_tree.set_defaults(func=cmd_deps_tree)
 
+    resolve = subparsers.add_parser("resolve", help="Resolve the transitive module graph with minimal version selection")
+    _add_module_file_args(resolve)
+    _add_registry_args(resolve)
+    resolve.add_argument("--jobs", type=int, default=DEFAULT_JOBS, help="Concurrent registry requests")
+    _add_cache_args(resolve)
+    resolve.set_defaults(func=cmd_resolve)
+
+    prune_store = subparsers.add_parser("prune-store", help="Delete unused entries from the per-version MODULE.bazel store")
+    prune_store.add_argument("--older-than-days", type=float, default=30, help="Remove entries not read for this many days")
+    prune_store.add_argument("--all", action="store_true", help="Remove every entry")
+    prune_store.set_defaults(func=cmd_prune_store)
+
     check_upgrades = subparsers.add_parser(
         "check-upgrades",
         help="Compare direct deps against live BCR metadata and report upgradeable modules",
     )
-    check_upgrades.add_argument("--module-file", required=True, help="Path to root MODULE.bazel or an included module file")
-    check_upgrades.add_argument("--workspace-root", help="Workspace root (defaults to MODULE.bazel directory)")
+    _add_module_file_args(check_upgrades)
     check_upgrades.add_argument("--module", action="append", help="Only inspect named module(s)")
-    check_upgrades.add_argument("--registry-url", default=DEFAULT_REGISTRY_URL)
+    _add_registry_args(check_upgrades)
     check_upgrades.add_argument("--include-prerelease", action="store_true", help="Allow prerelease versions such as rc/beta")
     check_upgrades.add_argument("--include-yanked", action="store_true", help="Allow yanked versions")
+    check_upgrades.add_argument("--jobs", type=int, default=DEFAULT_JOBS, help="Concurrent registry requests")
+    _add_cache_args(check_upgrades)
     check_upgrades.set_defaults(func=cmd_check_upgrades)
 
     upgrade = subparsers.add_parser("upgrade", help="Update bazel_dep versions to latest")
-    upgrade.add_argument("--module-file", required=True, help="Path to root MODULE.bazel or an included module file")
-    upgrade.add_argument("--workspace-root", help="Workspace root (defaults to MODULE.bazel directory)")
+    _add_module_file_args(upgrade)
     upgrade.add_argument("--module", action="append", help="Only upgrade named module(s)")
     upgrade.add_argument("--include-overrides", action="store_true", help="Also update single_version_override entries")
-    upgrade.add_argument("--registry-url", default=DEFAULT_REGISTRY_URL)
+    _add_registry_args(upgrade)
     upgrade.add_argument("--include-prerelease", action="store_true", help="Allow prerelease versions such as rc/beta")
     upgrade.add_argument("--include-yanked", action="store_true", help="Allow yanked versions")
+    upgrade.add_argument("--jobs", type=int, default=DEFAULT_JOBS, help="Concurrent registry requests")
+    _add_cache_args(upgrade)
     upgrade.add_argument("--write", action="store_true", help="Write updates to files instead of printing diffs")
     upgrade.set_defaults(func=cmd_upgrade)
 
+    snapshot = subparsers.add_parser(
+        "snapshot", help="Bundle every module's metadata.json into one compressed file for offline lookups"
+    )
+    snapshot.add_argument("--output", required=True, help="Bundle file to write")
+    _add_registry_args(snapshot)
+    snapshot.add_argument(
+        "--module", action="append", help="Crawl seed module (repeatable); without seeds a local registry is bundled whole"
+    )
+    snapshot.add_argument("--seed-module-file", help="Crawl seeds: the bazel_deps of this MODULE.bazel and its includes")
+    snapshot.add_argument("--module-files", action="store_true", help="Also bundle each version's MODULE.bazel")
+    snapshot.add_argument("--jobs", type=int, default=DEFAULT_JOBS, help="Concurrent registry requests when crawling")
+    _add_cache_args(snapshot)
+    snapshot.set_defaults(func=cmd_snapshot)
+
+    serve = subparsers.add_parser(
+        "serve",
+        help="Run a daemon on a Unix socket that other bcr_tool invocations hand their commands to",
+    )
+    serve.add_argument("--socket", help="Socket path (default: $BCR_TOOL_SOCKET or $XDG_CACHE_HOME/bcr_tool/daemon.sock)")
+    serve.add_argument("--idle-timeout", type=float, default=1800, help="Exit after this many idle seconds (0: never)")
+    serve.add_argument("--stop", action="store_true", help="Stop a running daemon instead of starting one")
+    serve.set_defaults(func=cmd_serve)
+
     return parser.parse_args(argv)
 
 
-def main(argv: Sequence[str]) -> int:
+def _run(argv: Sequence[str]) -> int:
     args = _parse_args(argv)
-    args.func(args)
+    try:
+        args.func(args)
+    except OfflineError as err:
+        print(f"error: {err.reason}", file=sys.stderr)
+        return 1
     return 0
 
 
+def main(argv: Sequence[str]) -> int:
+    if argv[:1] != ["serve"]:
+        code = _run_in_daemon(argv)
+        if code is not None:
+            return code
+    try:
+        return _run(argv)
+    finally:
+        _close_fetchers()
+
+
 if __name__ == "__main__":
     raise SystemExit(main(sys.argv[1:]))
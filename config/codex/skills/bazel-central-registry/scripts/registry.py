@@ -20,78 +20,300 @@
 """Tool classes to handle a Bazel registry"""
 
 import base64
+import collections
+import concurrent.futures
+import contextlib
 import difflib
 import functools
 import hashlib
+import http.client
+import io
+import itertools
 import json
+import mmap
 import netrc
+import os
 import pathlib
 import posixpath
-import re
 import shutil
+import tempfile
+import threading
+import time
 import urllib.parse
 import urllib.request
 import yaml
 from urllib.error import HTTPError
 
+import bazel_version
+
 GREEN = "\x1b[32m"
 RESET = "\x1b[0m"
 
 PRESUBMIT_YML = "presubmit.yml"
 MODULE_DOT_BAZEL = "MODULE.bazel"
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+ARCHIVE_CACHE_MAX_BYTES = 4 << 30
+AUTHORIZATION_HEADER_NAME = "Authorization"
+METADATA_JOBS = 8
+METADATA_CHUNK = 32
+ADD_JOBS = 8
 
 
 def log(msg):
-    print(f"{GREEN}INFO: {RESET}{msg}")
+    # One write per line, so lines logged from worker threads do not interleave.
+    print(f"{GREEN}INFO: {RESET}{msg}\n", end="")
 
 
-def download(url):
-    authorization_header_name = "Authorization"
+class Github404ErrorProcessor(urllib.request.BaseHandler):
+    """Work around Github authorization header weirdness.
 
-    class Github404ErrorProcessor(urllib.request.BaseHandler):
-        """Work around Github authorization header weirdness.
+    For private archives, Github requires an authorization token
+    in the initial GET, but no token on the redirected request
+    (which contains a token in the URL).  An authorization token
+    leads to a 404, which we handle here.  By default, urllib
+    includes all the original headers in the redirected request.
 
-        For private archives, Github requires an authorization token
-        in the initial GET, but no token on the redirected request
-        (which contains a token in the URL).  An authorization token
-        leads to a 404, which we handle here.  By default, urllib
-        includes all the original headers in the redirected request.
+    """
 
-        """
+    def http_error_404(self, request, fp, code, msg, hdrs):
+        # Try again without the Authorization header.
+        auth = request.headers.pop(AUTHORIZATION_HEADER_NAME, None)
+        if auth is None:
+            raise HTTPError(request.full_url, code, msg, hdrs, fp)
+        new = urllib.request.Request(request.full_url, headers=request.headers)
+        fp.read()
+        fp.close()
+        return self.parent.open(new, timeout=request.timeout)
+
+
+class _PooledResponse:
+    """File-like HTTP response that hands its connection back when done.
+
+    A connection whose response was not read to the end cannot be reused,
+    so closing early drops it from the pool instead.
+    """
+
+    def __init__(self, response, url, release):
+        self._response = response
+        self._release = release
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+    def read(self, amt=None):
+        data = self._response.read(amt)
+        if self._response.isclosed():
+            self.close()
+        return data
+
+    def close(self):
+        if self._release:
+            reusable = self._response.isclosed() and not self._response.will_close
+            self._response.close()
+            self._release(reusable)
+            self._release = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
-        def http_error_404(self, request, fp, code, msg, hdrs):
-            # Try again without the Authorization header.
-            auth = request.headers.pop(authorization_header_name, None)
-            if auth is None:
-                raise HTTPError(req.full_url, code, msg, headers, fp)
-            new = urllib.request.Request(request.full_url, headers=request.headers)
-            fp.read()
-            fp.close()
-            return self.parent.open(new, timeout=request.timeout)
-
-    opener = urllib.request.build_opener(Github404ErrorProcessor)
-    urllib.request.install_opener(opener)
-    parts = urllib.parse.urlparse(url)
-    headers = {"User-Agent": "curl/8.7.1"}  # Set the User-Agent header
-    try:
-        authenticators = netrc.netrc().authenticators(parts.netloc)
-    except FileNotFoundError:
-        authenticators = None
-    if authenticators != None:
-        (login, _, password) = authenticators
-        req = urllib.request.Request(url, headers=headers)
-        creds = base64.b64encode(str.encode("%s:%s" % (login, password))).decode()
-        req.add_header(authorization_header_name, "Basic %s" % creds)
-    else:
-        req = urllib.request.Request(url, headers=headers)
 
-    with urllib.request.urlopen(req) as response:
-        return response.read()
+class Session:
+    """Reusable HTTP client for registry downloads.
 
+    Credentials from ~/.netrc are looked up once per host, and each thread
+    keeps one persistent connection per (scheme, host), so fetching many
+    files from the same registry or archive host reuses a single TLS
+    connection. Transient 5xx responses and dropped keep-alive connections
+    are retried with exponential backoff. URLs that need a proxy or a
+    non-HTTP scheme go through urllib (with `Github404ErrorProcessor`).
+    """
 
-def download_file(url, file):
-    with open(file, "wb") as f:
-        f.write(download(url))
+    def __init__(self, retries=3, backoff=0.5, timeout=60, max_redirects=10):
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self._lock = threading.Lock()
+        self._netrc = None
+        self._credentials = {}
+        self._local = threading.local()
+        self._proxies = urllib.request.getproxies()
+        self._opener = urllib.request.build_opener(Github404ErrorProcessor)
+
+    def _authorization(self, host):
+        with self._lock:
+            if host not in self._credentials:
+                if self._netrc is None:
+                    try:
+                        self._netrc = netrc.netrc()
+                    except FileNotFoundError:
+                        self._netrc = False
+                authenticators = self._netrc.authenticators(host) if self._netrc else None
+                if authenticators is None:
+                    self._credentials[host] = None
+                else:
+                    (login, _, password) = authenticators
+                    creds = base64.b64encode(str.encode("%s:%s" % (login, password))).decode()
+                    self._credentials[host] = "Basic %s" % creds
+            return self._credentials[host]
+
+    def _headers(self, url):
+        headers = {"User-Agent": "curl/8.7.1"}  # Set the User-Agent header
+        authorization = self._authorization(urllib.parse.urlparse(url).netloc)
+        if authorization:
+            headers[AUTHORIZATION_HEADER_NAME] = authorization
+        return headers
+
+    def _uses_urllib(self, parts):
+        if parts.scheme not in ("http", "https"):
+            return True
+        return parts.scheme in self._proxies and not urllib.request.proxy_bypass(parts.hostname or "")
+
+    def _connection(self, parts):
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        key = (parts.scheme, parts.netloc)
+        conn = connections.pop(key, None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+            conn = cls(parts.netloc, timeout=self.timeout)
+
+        def release(reusable):
+            if reusable and key not in connections:
+                connections[key] = conn
+            else:
+                conn.close()
+
+        return conn, release
+
+    def _request(self, url, headers):
+        """Send one GET over a pooled connection, retrying transient failures."""
+        parts = urllib.parse.urlparse(url)
+        path = urllib.parse.urlunparse(("", "", parts.path or "/", parts.params, parts.query, ""))
+        for attempt in range(self.retries + 1):
+            conn, release = self._connection(parts)
+            try:
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                release(False)
+                if attempt == self.retries:
+                    raise
+                continue
+            except Exception:
+                release(False)
+                raise
+            if response.status < 500 or attempt == self.retries:
+                return _PooledResponse(response, url, release)
+            response.read()
+            release(not response.will_close)
+            time.sleep(self.backoff * 2**attempt)
+
+    def open(self, url):
+        """Open `url` for reading; raises HTTPError for non-2xx responses."""
+        headers = self._headers(url)
+        if self._uses_urllib(urllib.parse.urlparse(url)):
+            return self._opener.open(urllib.request.Request(url, headers=headers), timeout=self.timeout)
+        for _ in range(self.max_redirects + 1):
+            response = self._request(url, headers)
+            if response.status in (301, 302, 303, 307, 308) and response.headers.get("Location"):
+                location = urllib.parse.urljoin(url, response.headers["Location"])
+                response.read()
+                response.close()
+                if self._uses_urllib(urllib.parse.urlparse(location)):
+                    return self._opener.open(urllib.request.Request(location, headers=headers), timeout=self.timeout)
+                url = location
+                continue
+            if response.status == 404 and AUTHORIZATION_HEADER_NAME in headers:
+                # Same Github workaround as Github404ErrorProcessor: try again
+                # without the Authorization header.
+                response.read()
+                response.close()
+                headers = {k: v for k, v in headers.items() if k != AUTHORIZATION_HEADER_NAME}
+                continue
+            if not 200 <= response.status < 300:
+                body = response.read()
+                response.close()
+                raise HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(body))
+            return response
+        raise HTTPError(url, 310, "Too many redirects", None, None)
+
+    def get(self, url):
+        with self.open(url) as response:
+            return response.read()
+
+
+_default_session = None
+_default_session_lock = threading.Lock()
+
+
+def default_session():
+    """The process-wide Session shared by the module-level helpers."""
+    global _default_session
+    with _default_session_lock:
+        if _default_session is None:
+            _default_session = Session()
+        return _default_session
+
+
+def download(url, session=None):
+    return (session or default_session()).get(url)
+
+
+def download_file(url, file, session=None):
+    download_integrity(url, tee=file, session=session)
+
+
+class StreamedDownload:
+    """Result of `download_integrity`: SRI hashes plus transfer statistics."""
+
+    def __init__(self, url, integrities, size, seconds):
+        self.url = url
+        self.integrities = integrities
+        self.size = size
+        self.seconds = seconds
+
+    def integrity(self, algorithm="sha256"):
+        return self.integrities[algorithm]
+
+    @property
+    def throughput(self):
+        """Transfer rate in MB/s."""
+        return self.size / 1e6 / self.seconds if self.seconds > 0 else float("inf")
+
+    def summary(self):
+        return f"{self.size / 1e6:.1f} MB in {self.seconds:.2f}s ({self.throughput:.1f} MB/s)"
+
+
+def download_integrity(url, algorithms=("sha256",), tee=None, chunk_size=DOWNLOAD_CHUNK_SIZE, session=None):
+    """Download `url` and compute its SRI hashes without holding it in memory.
+
+    Every chunk is fed to one hasher per algorithm as it arrives, so several
+    SRI algorithms cost a single pass. If `tee` is a path, the bytes are also
+    written there.
+    """
+    hashers = {algorithm: _sri_hasher(algorithm) for algorithm in algorithms}
+    size = 0
+    start = time.monotonic()
+    with contextlib.ExitStack() as stack:
+        response = stack.enter_context((session or default_session()).open(url))
+        out = stack.enter_context(open(tee, "wb")) if tee else None
+        while True:
+            chunk = response.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            for hasher in hashers.values():
+                hasher.update(chunk)
+            if out:
+                out.write(chunk)
+    integrities = {algorithm: _sri(algorithm, hasher) for algorithm, hasher in hashers.items()}
+    return StreamedDownload(url, integrities, size, time.monotonic() - start)
 
 
 def read(path):
@@ -99,18 +321,144 @@ def read(path):
         return file.read()
 
 
-def integrity(data, algorithm="sha256"):
+def _sri_hasher(algorithm):
     assert algorithm in {
         "sha224",
         "sha256",
         "sha384",
         "sha512",
     }, "Unsupported SRI algorithm"
-    hash = getattr(hashlib, algorithm)(data)
-    encoded = base64.b64encode(hash.digest()).decode()
+    return getattr(hashlib, algorithm)()
+
+
+def _sri(algorithm, hasher):
+    encoded = base64.b64encode(hasher.digest()).decode()
     return f"{algorithm}-{encoded}"
 
 
+def integrity(data, algorithm="sha256"):
+    hasher = _sri_hasher(algorithm)
+    hasher.update(data)
+    return _sri(algorithm, hasher)
+
+
+def file_integrity(path, algorithms=("sha256",)):
+    """Compute SRI hashes of a file through a read-only memory map."""
+    hashers = {algorithm: _sri_hasher(algorithm) for algorithm in algorithms}
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for hasher in hashers.values():
+                    hasher.update(mapped)
+    return {algorithm: _sri(algorithm, hasher) for algorithm, hasher in hashers.items()}
+
+
+def default_cache_dir():
+    return pathlib.Path(os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache") / "bcr_tool"
+
+
+class ArchiveCache:
+    """Content-addressed cache of downloaded source archives.
+
+    Archives are stored once under `cas/<algorithm>/<hex digest>` and can be
+    found by their SRI integrity or, through a small record under `urls/`, by
+    the URL they were downloaded from. Cached archives are re-hashed (via
+    mmap) on every URL hit so a corrupted blob is never trusted. The least
+    recently used blobs are evicted once the cache exceeds `max_bytes`.
+    """
+
+    def __init__(self, root=None, max_bytes=ARCHIVE_CACHE_MAX_BYTES):
+        self.root = pathlib.Path(root) if root else default_cache_dir() / "archives"
+        self.max_bytes = max_bytes
+        self._evict_lock = threading.Lock()
+
+    def blob_path(self, sri):
+        algorithm, encoded = sri.split("-", 1)
+        return self.root / "cas" / algorithm / base64.b64decode(encoded).hex()
+
+    def _url_record_path(self, url):
+        return self.root / "urls" / (hashlib.sha256(url.encode()).hexdigest() + ".json")
+
+    def lookup_integrity(self, sri):
+        """Return the path of the cached archive with this integrity, if any."""
+        path = self.blob_path(sri)
+        try:
+            os.utime(path)
+        except OSError:  # not cached, or evicted meanwhile
+            return None
+        return path
+
+    def lookup_url(self, url):
+        """Return (integrity, path) for a cached download of `url`, if still valid."""
+        try:
+            record = json.loads(self._url_record_path(url).read_text())
+        except (OSError, ValueError):
+            return None
+        sri = record.get("integrity")
+        path = self.lookup_integrity(sri) if record.get("url") == url and sri else None
+        if path is None:
+            return None
+        algorithm = sri.split("-", 1)[0]
+        try:
+            actual = file_integrity(path, (algorithm,))[algorithm]
+        except OSError:
+            return None
+        if actual != sri:
+            path.unlink(missing_ok=True)
+            return None
+        return sri, path
+
+    def fetch(self, url, refresh=False):
+        """Return (sha256 integrity, path) for `url`, downloading it on a miss."""
+        if not refresh:
+            cached = self.lookup_url(url)
+            if cached:
+                log(f"Reusing cached archive for {url}")
+                return cached
+        tmp_dir = self.root / "tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=tmp_dir)
+        os.close(fd)
+        try:
+            archive = download_integrity(url, tee=tmp)
+            log(f"Downloaded {url}: {archive.summary()}")
+            sri = archive.integrity()
+            path = self.blob_path(sri)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp, path)
+        finally:
+            pathlib.Path(tmp).unlink(missing_ok=True)
+        record_path = self._url_record_path(url)
+        record_path.parent.mkdir(parents=True, exist_ok=True)
+        record_path.write_text(json.dumps({"url": url, "integrity": sri}))
+        self.evict(keep=path)
+        return sri, path
+
+    def evict(self, keep=None):
+        """Delete least recently used blobs until the cache fits in `max_bytes`.
+
+        `keep` (the blob just stored) is never deleted, even if it alone is
+        larger than the limit. Blobs may disappear concurrently, from other
+        threads or processes sharing the cache, so missing files are skipped.
+        """
+        with self._evict_lock:
+            blobs = []
+            for path in self.root.glob("cas/*/*"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                blobs.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in blobs)
+            for _, size, path in sorted(blobs):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                path.unlink(missing_ok=True)
+                total -= size
+
+
 def integrity_for_comparison(data, expected_integrity):
     algorithm, _ = expected_integrity.split("-", 1)
     return integrity(data, algorithm)
@@ -122,6 +470,26 @@ def json_dump(file, data, sort_keys=True):
         f.write("\n")
 
 
+def version_key(version_str):
+    """Return a plain tuple that sorts like `Version(version_str)`.
+
+    The ordering lives in bazel_version.py, shared with bcr_tool.py; this
+    wrapper rejects the empty version and reports invalid ones as
+    RegistryException.
+    """
+    if not version_str:
+        raise RegistryException(f"`{version_str}` is not a valid version")
+    try:
+        return bazel_version.version_key(version_str)
+    except ValueError as ex:
+        raise RegistryException(str(ex)) from None
+
+
+def sort_versions(versions, reverse=False):
+    """Sort version strings in Bazel module version order."""
+    return sorted(versions, key=version_key, reverse=reverse)
+
+
 # Translated from:
 # https://github.com/bazelbuild/bazel/blob/79a53def2ebbd9358450f739ea37bf70662e8614/src/main/java/com/google/devtools/build/lib/bazel/bzlmod/Version.java#L58
 @functools.total_ordering
@@ -150,24 +518,25 @@ class Version:
         return [Version.Identifier(i) for i in s.split(".")]
 
     def __init__(self, version_str):
-        PATTERN = re.compile(r"^([a-zA-Z0-9.]+)(?:-([a-zA-Z0-9.-]+))?(?:\+[a-zA-Z0-9.-]+)?$")
-        m = PATTERN.match(version_str)
-        if not m:
-            raise RegistryException(f"`{version_str}` is not a valid version")
-        self.release = Version.convert_to_identifiers(m.groups()[0])
-        self.prerelease = Version.convert_to_identifiers(m.groups()[1])
+        self.version_str = version_str
+        self.key = version_key(version_str)
+
+    @property
+    def release(self):
+        return Version.convert_to_identifiers(bazel_version.VERSION_PATTERN.match(self.version_str).group(1))
+
+    @property
+    def prerelease(self):
+        return Version.convert_to_identifiers(bazel_version.VERSION_PATTERN.match(self.version_str).group(2))
 
     def __eq__(self, other):
-        return (self.release, self.prerelease) == (other.release, other.prerelease)
+        return self.key == other.key
 
     def __lt__(self, other):
-        if self.release != other.release:
-            return self.release < other.release
-        if self.prerelease == None:
-            return False
-        if other.prerelease == None:
-            return True
-        return self.prerelease < other.prerelease
+        return self.key < other.key
+
+    def __hash__(self):
+        return hash(self.key)
 
 
 class Module:
@@ -260,29 +629,89 @@ module(
 )
 """.strip()
 
-    def __init__(self, root):
+    def __init__(self, root, archive_cache=None):
         self.root = pathlib.Path(root)
+        self.archive_cache = archive_cache
+        # module name -> (mtime_ns, size, parsed metadata.json)
+        self._metadata_cache = {}
+
+    def _archive_integrity(self, url, refresh=False, algorithm="sha256"):
+        """SRI of the archive at `url`, reusing `archive_cache` when configured."""
+        if self.archive_cache:
+            sri, path = self.archive_cache.fetch(url, refresh=refresh)
+            return sri if algorithm == "sha256" else file_integrity(path, (algorithm,))[algorithm]
+        archive = download_integrity(url, (algorithm,))
+        log(f"Downloaded {url}: {archive.summary()}")
+        return archive.integrity(algorithm)
 
     def get_all_modules(self):
         modules_dir = self.root.joinpath("modules")
         return [path.name for path in modules_dir.iterdir()]
 
     def get_module_versions(self, module_name, include_yanked=True):
-        module_versions = []
         metadata = self.get_metadata(module_name)
-        for version in metadata["versions"]:
-            if include_yanked or version not in metadata.get("yanked_versions", {}):
-                module_versions.append((module_name, version))
-        return module_versions
+        return [(name, version) for name, version, _ in self._versions_of(module_name, metadata, include_yanked)]
 
     def get_all_module_versions(self, include_yanked=True):
-        module_versions = []
-        for module_name in self.get_all_modules():
-            module_versions.extend(self.get_module_versions(module_name, include_yanked))
-        return module_versions
+        return [(module_name, version) for module_name, version, _ in self.iter_module_versions(include_yanked)]
+
+    def iter_module_versions(self, include_yanked=True, jobs=METADATA_JOBS):
+        """Lazily yield (module name, version, metadata) for every module version.
+
+        metadata.json files are read and parsed ahead of the consumer on a
+        pool of `jobs` threads, at most a few chunks ahead, so work can start
+        on the first module right away. The metadata dicts are shared
+        with the in-process cache and must not be modified.
+        """
+        module_names = self.get_all_modules()
+        if jobs <= 1:
+            for module_name in module_names:
+                yield from self._versions_of(module_name, self.get_metadata(module_name), include_yanked)
+            return
+
+        def read_chunk(names):
+            return [(name, self.get_metadata(name)) for name in names]
+
+        # Hand out small chunks rather than single files to keep the per-task
+        # overhead below the cost of reading a metadata.json.
+        chunks = (module_names[i : i + METADATA_CHUNK] for i in range(0, len(module_names), METADATA_CHUNK))
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+        try:
+            window = collections.deque(pool.submit(read_chunk, chunk) for chunk in itertools.islice(chunks, jobs * 2))
+            while window:
+                future = window.popleft()
+                for chunk in itertools.islice(chunks, 1):
+                    window.append(pool.submit(read_chunk, chunk))
+                for module_name, metadata in future.result():
+                    yield from self._versions_of(module_name, metadata, include_yanked)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    @staticmethod
+    def _versions_of(module_name, metadata, include_yanked):
+        for version in metadata["versions"]:
+            if include_yanked or version not in metadata.get("yanked_versions", {}):
+                yield module_name, version, metadata
 
     def get_metadata(self, module_name):
-        return json.loads(self.get_metadata_path(module_name).read_text(encoding="utf-8"))
+        """Parsed metadata.json of a module.
+
+        Parsed files are cached per client and re-read only when their mtime or
+        size changes, so repeated queries in one run share a single read. The
+        returned dict is shared; copy it before modifying.
+        """
+        path = self.get_metadata_path(module_name)
+        stat = path.stat()
+        cached = self._metadata_cache.get(module_name)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        metadata = json.loads(path.read_text(encoding="utf-8"))
+        self._metadata_cache[module_name] = (stat.st_mtime_ns, stat.st_size, metadata)
+        return metadata
+
+    def _write_metadata(self, module_name, metadata):
+        self._metadata_cache.pop(module_name, None)
+        json_dump(self.get_metadata_path(module_name), metadata)
 
     def get_metadata_path(self, module_name):
         return self.root / "modules" / module_name / "metadata.json"
@@ -355,7 +784,7 @@ module(
             "versions": [],
             "yanked_versions": {},
         }
-        json_dump(p.joinpath("metadata.json"), metadata)
+        self._write_metadata(module_name, metadata)
 
     def add(self, module, override=False):
         """
@@ -376,6 +805,86 @@ module(
             else:
                 raise RegistryException(f"Version {module.version} for module {module.name} already exists.")
 
+        self._write_version(module, self._archive_integrity(module.url))
+
+        # Add new version to metadata.json
+        self._add_versions(module.name, [module.version])
+
+    def add_batch(self, modules, override=False, jobs=ADD_JOBS):
+        """
+        Add many module versions at once, the modules must be already initialized
+
+        Archives are downloaded concurrently, once per distinct URL, then the
+        version directories are written on a pool of `jobs` threads. Each
+        module's metadata.json is updated once at the end, with the versions
+        whose directory was written, even if others failed; the first failure
+        is raised afterwards. A version that fails to write is left as it was:
+        its partial directory is removed and, with `override`, the previous
+        directory is put back.
+
+        Parameters
+        ----------
+        modules : list of Module
+            The module versions to add
+        override : Whether to override existing module versions
+        jobs : Number of concurrent downloads and writers
+        """
+        counts = collections.Counter((module.name, module.version) for module in modules)
+        duplicates = sorted(f"{name}@{version}" for (name, version), count in counts.items() if count > 1)
+        if duplicates:
+            raise RegistryException(f"Module versions listed more than once: {', '.join(duplicates)}")
+        for module in modules:
+            if not self.get_metadata_path(module.name).exists():
+                raise RegistryException(f"Module {module.name} is not initialized.")
+            if self.contains(module.name, module.version) and not override:
+                raise RegistryException(f"Version {module.version} for module {module.name} already exists.")
+
+        jobs = max(1, jobs)
+        urls = list(dict.fromkeys(module.url for module in modules))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+            integrities = dict(zip(urls, pool.map(self._archive_integrity, urls)))
+
+        def write(module):
+            version_dir = self.get_version_dir(module.name, module.version)
+            backup = None
+            if version_dir.is_dir():
+                log("Overriding module '%s' at version '%s'..." % (module.name, module.version))
+                backup = version_dir.with_name(f".{module.version}.override")
+                shutil.rmtree(backup, ignore_errors=True)
+                version_dir.rename(backup)
+            try:
+                self._write_version(module, integrities[module.url])
+            except BaseException:
+                shutil.rmtree(version_dir, ignore_errors=True)
+                if backup is not None:
+                    backup.rename(version_dir)
+                raise
+            if backup is not None:
+                shutil.rmtree(backup)
+
+        added = collections.defaultdict(list)
+        error = None
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(write, module): module for module in modules}
+            for future in concurrent.futures.as_completed(futures):
+                module = futures[future]
+                if future.exception() is None:
+                    added[module.name].append(module.version)
+                elif error is None:
+                    error = future.exception()
+
+        for module_name, versions in added.items():
+            self._add_versions(module_name, versions)
+        if error is not None:
+            raise error
+
+    def _add_versions(self, module_name, versions):
+        metadata = dict(self.get_metadata(module_name))
+        metadata["versions"] = sort_versions(set(metadata["versions"]) | set(versions))
+        self._write_metadata(module_name, metadata)
+
+    def _write_version(self, module, source_integrity):
+        """Write the version directory of `module`, whose source archive has `source_integrity`."""
         p = self.root.joinpath("modules", module.name, module.version)
         p.mkdir()
 
@@ -398,7 +907,7 @@ module(
         # Create source.json & copy patch files to the registry
         source = {
             "url": module.url,
-            "integrity": integrity(download(module.url)),
+            "integrity": source_integrity,
         }
         if module.strip_prefix:
             source["strip_prefix"] = module.strip_prefix
@@ -474,43 +983,26 @@ module(
             with presubmit_yml.open("w") as f:
                 yaml.dump(presubmit, f, sort_keys=False)
 
-        # Add new version to metadata.json
-        metadata_path = self.root.joinpath("modules", module.name, "metadata.json")
-        metadata = json.load(metadata_path.open())
-        metadata["versions"].append(module.version)
-        metadata["versions"] = list(set(metadata["versions"]))
-        metadata["versions"].sort(key=Version)
-        json_dump(metadata_path, metadata)
-
     def update_versions(self, module_name):
         """Update the list of versions in the metadata.json."""
         module_path = self.root / "modules" / module_name
         versions = (v.name for v in module_path.iterdir() if v.is_dir())
-        metadata = self.get_metadata(module_name)
-        metadata["versions"] = sorted(versions, key=Version)
-        metadata_path = self.get_metadata_path(module_name)
-        json_dump(metadata_path, metadata)
+        metadata = dict(self.get_metadata(module_name))
+        metadata["versions"] = sort_versions(versions)
+        self._write_metadata(module_name, metadata)
 
-    def update_integrity(self, module_name, version):
-        """Update the SRI hashes of the source.json file of module at version."""
-        source = self.get_source(module_name, version)
-        source["integrity"] = integrity(download(source["url"]))
-        source_path = self.get_source_json_path(module_name, version)
-
-        patch_dir = source_path.parent / "patches"
+    def _patch_integrities(self, module_name, version, current):
+        """SRI hashes of the `current` patches followed by any other file in patches/."""
+        patch_dir = self.get_version_dir(module_name, version) / "patches"
         if patch_dir.exists():
             available = sorted(p.name for p in patch_dir.iterdir())
         else:
             available = []
-        current = source.get("patches", {}).keys()
         patch_files = [patch_dir / p for p in current]
         patch_files.extend(patch_dir / p for p in available if p not in current)
-        patches = {str(patch.relative_to(patch_dir)): integrity(read(patch)) for patch in patch_files}
-        if patches:
-            source["patches"] = patches
-        else:
-            source.pop("patches", None)
+        return {str(patch.relative_to(patch_dir)): integrity(read(patch)) for patch in patch_files}
 
+    def _overlay_integrities(self, module_name, version):
         overlay_dir = self.get_overlay_dir(module_name, version)
         overlay_files = []
         if overlay_dir.exists():
@@ -521,8 +1013,60 @@ module(
                     if p.is_file() and p.name != "MODULE.bazel.lock"
                 ]
             )
-        overlay_integrities = {str(file): integrity(read(overlay_dir / file)) for file in overlay_files}
-        if overlay_files:
+        return {str(file): integrity(read(overlay_dir / file)) for file in overlay_files}
+
+    def verify_integrity(self, module_name, version, check_archive=False):
+        """Compare the SRI hashes in source.json of module at version with the files on disk.
+
+        Returns a list of mismatches, each a dict with the offending file and
+        the expected (recorded) and actual integrity; either is None when the
+        file is only on one side. The source archive is only downloaded when
+        `check_archive` is set, and then always from upstream: a cached copy
+        would hide an archive that was re-rolled since it was cached.
+        """
+        source = self.get_source(module_name, version)
+        patch_dir = self.get_version_dir(module_name, version) / "patches"
+        listed_patches = [p for p in source.get("patches", {}) if (patch_dir / p).is_file()]
+        mismatches = []
+
+        def compare(file, expected, actual):
+            if expected != actual:
+                mismatches.append(
+                    {"module": module_name, "version": version, "file": file, "expected": expected, "actual": actual}
+                )
+
+        for kind, actual in (
+            ("patches", self._patch_integrities(module_name, version, listed_patches)),
+            ("overlay", self._overlay_integrities(module_name, version)),
+        ):
+            expected = source.get(kind, {})
+            for name in sorted(expected.keys() | actual.keys()):
+                compare(f"{kind}/{name}", expected.get(name), actual.get(name))
+        if check_archive and "url" in source:
+            expected = source.get("integrity")
+            algorithm = expected.split("-", 1)[0] if expected else "sha256"
+            actual = self._archive_integrity(source["url"], refresh=True, algorithm=algorithm)
+            compare(source["url"], expected, actual)
+        return mismatches
+
+    def update_integrity(self, module_name, version, refresh=False):
+        """Update the SRI hashes of the source.json file of module at version.
+
+        With an archive cache, a previously downloaded archive for the same URL
+        is reused unless `refresh` is set (e.g. after upstream re-rolled it).
+        """
+        source = self.get_source(module_name, version)
+        source["integrity"] = self._archive_integrity(source["url"], refresh=refresh)
+        source_path = self.get_source_json_path(module_name, version)
+
+        patches = self._patch_integrities(module_name, version, source.get("patches", {}).keys())
+        if patches:
+            source["patches"] = patches
+        else:
+            source.pop("patches", None)
+
+        overlay_integrities = self._overlay_integrities(module_name, version)
+        if overlay_integrities:
             source["overlay"] = overlay_integrities
         else:
             source.pop("overlay", None)
@@ -533,16 +1077,14 @@ module(
         """Delete an existing module version."""
         p = self.root.joinpath("modules", module_name)
         shutil.rmtree(p.joinpath(version))
-        metadata_path = p.joinpath("metadata.json")
-        metadata = json.load(metadata_path.open())
-        if version in metadata["versions"]:
-            metadata["versions"].remove(version)
-        json_dump(metadata_path, metadata)
+        metadata = dict(self.get_metadata(module_name))
+        metadata["versions"] = [v for v in metadata["versions"] if v != version]
+        self._write_metadata(module_name, metadata)
 
 
-def _download_if_exists(url):
+def _download_if_exists(url, session=None):
     try:
-        return download(url)
+        return download(url, session)
     except urllib.error.HTTPError as ex:
         if ex.code == 404:
             return None
@@ -551,28 +1093,77 @@ def _download_if_exists(url):
 
 
 class UpstreamRegistry:
-    def __init__(self, modules_dir_url):
+    def __init__(self, modules_dir_url, session=None):
         self._root_url = modules_dir_url
+        self._session = session or default_session()
 
-    def get_latest_module_version(self, module_name):
+    def get_metadata(self, module_name):
         metadata_url = posixpath.join(self._root_url, module_name, "metadata.json")
-        content = _download_if_exists(metadata_url)
+        content = _download_if_exists(metadata_url, self._session)
         if not content:
             return None
 
-        metadata = json.loads(content)
+        return json.loads(content)
+
+    def get_latest_module_version(self, module_name):
+        metadata = self.get_metadata(module_name)
+        if not metadata:
+            return None
+
         latest_version = metadata["versions"][-1]  # Presubmit ensures asc. order
         module_root_url = posixpath.join(self._root_url, module_name, latest_version)
-        return ModuleSnapshot(latest_version, module_root_url)
+        return ModuleSnapshot(latest_version, module_root_url, self._session)
+
+    def get_module_snapshots(self, module_name, versions=None, last=None, include_yanked=False, jobs=METADATA_JOBS):
+        """Snapshots of several versions of a module, with their files already fetched.
+
+        Defaults to every version in metadata.json (oldest first, yanked ones
+        skipped unless `include_yanked`), or only the `last` N of them. All
+        files of all snapshots are downloaded concurrently on `jobs` threads.
+        Returns None if the module does not exist.
+        """
+        metadata = self.get_metadata(module_name)
+        if not metadata:
+            return None
+
+        if versions is None:
+            yanked = metadata.get("yanked_versions", {})
+            versions = [v for v in metadata["versions"] if include_yanked or v not in yanked]
+        if last:
+            versions = versions[-last:]
+        snapshots = [
+            ModuleSnapshot(version, posixpath.join(self._root_url, module_name, version), self._session)
+            for version in versions
+        ]
+        prefetch_snapshots(snapshots, jobs)
+        return snapshots
+
+
+def prefetch_snapshots(snapshots, jobs=METADATA_JOBS):
+    """Download every file of `snapshots` concurrently so later reads are served from memory."""
+    work = [(snapshot, filename) for snapshot in snapshots for filename in ModuleSnapshot.FILES]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        for _ in pool.map(lambda job: job[0]._download_if_exists(job[1]), work):
+            pass
 
 
 class ModuleSnapshot:
-    def __init__(self, version, root_url):
+    FILES = (PRESUBMIT_YML, "attestations.json", MODULE_DOT_BAZEL)
+
+    def __init__(self, version, root_url, session=None):
         self.version = version
         self._root_url = root_url
+        self._session = session or default_session()
+        self._files = {}
 
     def _download_if_exists(self, filename):
-        return _download_if_exists(posixpath.join(self._root_url, filename))
+        if filename not in self._files:
+            self._files[filename] = _download_if_exists(posixpath.join(self._root_url, filename), self._session)
+        return self._files[filename]
+
+    def prefetch(self, jobs=len(FILES)):
+        """Fetch presubmit.yml, attestations.json and MODULE.bazel concurrently."""
+        prefetch_snapshots([self], jobs)
 
     def presubmit_yml_lines(self):
         raw = self._download_if_exists(PRESUBMIT_YML)